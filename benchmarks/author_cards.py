@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    author_cards.py
+    ~~~~~~~~~~~~~
+
+    Compares a page of posts loaded with the joined `Post.author`
+    eager load against `as_list()` plus `prefetch_author_cards`, and
+    times rendering blog/list.html for the page. Runs against a
+    throwaway in-memory SQLite database.
+
+    Usage: python benchmarks/author_cards.py [-p 40] [-a 5] [-n 200]
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flaskext.sqlalchemy import Pagination
+
+from pypress import create_app
+from pypress.helpers import render_template
+from pypress.extensions import db, passwords
+from pypress.models import User, Post
+from pypress.models.users import author_cards
+from pypress.models.blog import prefetch_author_cards
+
+def setup(num_posts, num_authors):
+    passwords.iterations = 1000
+    db.create_all()
+
+    authors = []
+    for i in range(num_authors):
+        author = User(username="author%d" % i,
+                      nickname="Author %d" % i,
+                      email="author%d@example.com" % i,
+                      password="secret")
+        db.session.add(author)
+        authors.append(author)
+
+    for i in range(num_posts):
+        db.session.add(Post(author=authors[i % num_authors],
+                            title=u"post %d" % i,
+                            content=u"<p>content of post %d</p>" % i))
+    db.session.commit()
+
+def joined(num_posts):
+    posts = Post.query.limit(num_posts).all()
+    return [(p.author.username, p.author.nickname, p.author.email)
+            for p in posts]
+
+def cards(num_posts):
+    posts = prefetch_author_cards(Post.query.as_list().limit(num_posts).all())
+    return [(p.author_card.username, p.author_card.nickname,
+             p.author_card.email_hash) for p in posts]
+
+def render(num_posts):
+    query = Post.query.as_list()
+    posts = prefetch_author_cards(query.limit(num_posts).all())
+    page_obj = Pagination(query, 1, num_posts, num_posts, posts)
+    return render_template("blog/list.html",
+                           page_obj=page_obj,
+                           page_url=lambda page: "/page/%d/" % page)
+
+def timeit(func, num_posts, rounds):
+    # a fresh session each round, as in a request
+    db.session.remove()
+    func(num_posts)
+    start = time.time()
+    for i in range(rounds):
+        db.session.remove()
+        func(num_posts)
+    return (time.time() - start) / rounds
+
+def main():
+    parser = OptionParser(usage="%prog [-p POSTS] [-a AUTHORS] [-n ROUNDS]")
+    parser.add_option('-p', '--posts', dest='posts', type='int', default=40)
+    parser.add_option('-a', '--authors', dest='authors', type='int', default=5)
+    parser.add_option('-n', '--rounds', dest='rounds', type='int', default=200)
+    options, args = parser.parse_args()
+
+    app = create_app('config.cfg')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_ECHO'] = False
+
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        setup(options.posts, options.authors)
+
+        print "%d posts by %d authors, %d rounds" % (options.posts,
+                                                     options.authors,
+                                                     options.rounds)
+        print "%-24s %10s" % ("", "ms/page")
+        print "%-24s %10.2f" % ("joined author",
+                                timeit(joined, options.posts, options.rounds) * 1000)
+        print "%-24s %10.2f" % ("author cards (warm)",
+                                timeit(cards, options.posts, options.rounds) * 1000)
+
+        def cold(num_posts):
+            author_cards.clear()
+            return cards(num_posts)
+
+        print "%-24s %10.2f" % ("author cards (cold)",
+                                timeit(cold, options.posts, options.rounds) * 1000)
+        print "%-24s %10.2f" % ("render list.html",
+                                timeit(render, options.posts, options.rounds) * 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    passwords.py
+    ~~~~~~~~~~~~~
+
+    Measures password checks through the hashing pool, to choose
+    PASSWORD_ITERATIONS and PASSWORD_WORKERS against a login latency
+    budget. Each round fires CONCURRENCY simultaneous logins and
+    reports the latency percentiles seen by the callers.
+
+    Usage: python benchmarks/passwords.py [-i 20000,50000,100000] 
+                                          [-w 2] [-c 16]
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import threading
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pypress.passwords import PasswordHasher, PoolBusy
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def burst(hasher, encoded, concurrency):
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def login():
+        start = time.time()
+        try:
+            hasher.check('secret', encoded)
+        except PoolBusy:
+            with lock:
+                failures[0] += 1
+            return
+        with lock:
+            latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=login) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, failures[0]
+
+def main():
+    parser = OptionParser(usage="%prog [-i ITERATIONS,...] [-w WORKERS] [-c CONCURRENCY]")
+    parser.add_option('-i', '--iterations', dest='iterations', 
+                      default='20000,50000,100000')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=2)
+    parser.add_option('-c', '--concurrency', dest='concurrency', type='int', default=16)
+    options, args = parser.parse_args()
+
+    print "%d workers, %d concurrent logins" % (options.workers, options.concurrency)
+    print "%10s %10s %10s %10s %10s" % ("iterations", "single ms", 
+                                         "p50 ms", "p99 ms", "busy")
+
+    for iterations in [int(i) for i in options.iterations.split(',')]:
+        hasher = PasswordHasher()
+        hasher.iterations = iterations
+        hasher.pool.workers = options.workers
+        hasher.pool.queue_size = options.concurrency
+
+        encoded = hasher.hash('secret')
+
+        start = time.time()
+        hasher.check('secret', encoded)
+        single = time.time() - start
+
+        latencies, busy = burst(hasher, encoded, options.concurrency)
+
+        print "%10d %10.1f %10.1f %10.1f %10d" % (iterations, single * 1000,
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, busy)
+
+
+if __name__ == "__main__":
+    main()
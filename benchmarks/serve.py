@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    serve.py
+    ~~~~~~~~~~~~~
+
+    Throughput of `manage.py serve` over HTTP. For each layout of
+    workers x threads a server is started on the database of
+    config.cfg, the request plan of pypress/bench.py is replayed by
+    concurrent client processes, and requests per second, latency
+    percentiles and errors are reported.
+
+    Fill the database first, e.g. with `manage.py import` or the
+    generator of `manage.py bench -d sqlite:///bench.db`.
+
+    Usage: python benchmarks/serve.py [-l 1x1,1x4,4x1,4x4] [-c 16] [-n 2000]
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import urllib2
+import subprocess
+import multiprocessing
+
+from optparse import OptionParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+sys.path.insert(0, ROOT)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def wait_for(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.2)
+    return False
+
+def fetch(args):
+    base, urls = args
+    timings = []
+    errors = 0
+    for url in urls:
+        start = time.time()
+        try:
+            urllib2.urlopen(base + url, timeout=30).read()
+        except Exception:
+            errors += 1
+            continue
+        timings.append(time.time() - start)
+    return timings, errors
+
+def load(base, plan, clients):
+    chunks = [(base, plan[i::clients]) for i in range(clients)]
+    pool = multiprocessing.Pool(clients)
+    try:
+        start = time.time()
+        results = pool.map(fetch, chunks)
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    timings = sum((t for t, e in results), [])
+    errors = sum(e for t, e in results)
+    return timings, errors, elapsed
+
+def make_plan(requests, seed):
+    from pypress import create_app, bench
+
+    app = create_app('config.cfg')
+    with app.test_request_context():
+        return [url for route, url in bench.request_plan(requests, seed)]
+
+def main():
+    parser = OptionParser(usage="%prog [-l LAYOUTS] [-c CLIENTS] [-n REQUESTS]")
+    parser.add_option('-l', '--layouts', dest='layouts', default='1x1,1x4,4x1,4x4',
+                      help="workers x threads to try, comma separated")
+    parser.add_option('-c', '--clients', dest='clients', type='int', default=16)
+    parser.add_option('-n', '--requests', dest='requests', type='int', default=2000)
+    parser.add_option('-p', '--port', dest='port', type='int', default=8089)
+    parser.add_option('-s', '--seed', dest='seed', type='int', default=0)
+    parser.add_option('--no-preload', dest='preload', action='store_false',
+                      default=True)
+    options, args = parser.parse_args()
+
+    plan = make_plan(options.requests, options.seed)
+    base = "http://127.0.0.1:%d" % options.port
+
+    print "%d requests from %d clients" % (len(plan), options.clients)
+    print "%-10s %10s %10s %10s %8s" % ("layout", "req/s", "p50 ms", 
+                                        "p99 ms", "errors")
+
+    for layout in options.layouts.split(','):
+        workers, threads = layout.split('x')
+        command = [sys.executable, os.path.join(ROOT, 'manage.py'), 'serve',
+                   '-p', str(options.port), '-w', workers, '-t', threads,
+                   '--preload' if options.preload else '--no-preload']
+        server = subprocess.Popen(command, cwd=ROOT)
+        try:
+            if not wait_for('127.0.0.1', options.port):
+                print "%-10s server did not start" % layout
+                continue
+            # one pass to warm the workers, one measured
+            load(base, plan, options.clients)
+            timings, errors, elapsed = load(base, plan, options.clients)
+            print "%-10s %10.1f %10.2f %10.2f %8d" % (layout,
+                len(timings) / elapsed,
+                percentile(timings, 50) * 1000,
+                percentile(timings, 99) * 1000,
+                errors)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
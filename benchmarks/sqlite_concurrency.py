@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    sqlite_concurrency.py
+    ~~~~~~~~~~~~~
+
+    Runs reader and writer threads against a SQLite file, first with
+    SQLAlchemy's defaults and then with the profile of
+    pypress/database.py (WAL, pragmas, pooled connections and the
+    writer queue). Reports reads and writes per second, write latency,
+    "database is locked" failures and other database errors, and exits
+    with status 1 when a thread died, which makes the run meaningless.
+
+    The profile is not a plain win: the writer queue serializes writes
+    and each commit syncs the WAL, so writes per second can drop and
+    write latency grow while readers stop waiting on writers.
+
+    Usage: python benchmarks/sqlite_concurrency.py [-r 8] [-w 4] [-s 10]
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import traceback
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
+
+from pypress.database import engine_options, WriterQueue
+
+SCHEMA = ("CREATE TABLE comments (id INTEGER PRIMARY KEY, post_id INTEGER, "
+          "comment TEXT, created_date TIMESTAMP)")
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def run(engine, queue, readers, writers, seconds):
+    stop = time.time() + seconds
+    lock = threading.Lock()
+    stats = dict(reads=0, writes=0, locked=0, errors=0, died=0, latencies=[])
+
+    def failed(e):
+        with lock:
+            if 'locked' in str(e):
+                stats['locked'] += 1
+            else:
+                stats['errors'] += 1
+
+    def read():
+        while time.time() < stop:
+            try:
+                engine.execute("SELECT post_id, count(*) FROM comments "
+                               "GROUP BY post_id ORDER BY 2 DESC LIMIT 10").fetchall()
+            except DBAPIError, e:
+                failed(e)
+                continue
+            with lock:
+                stats['reads'] += 1
+
+    def write():
+        while time.time() < stop:
+            start = time.time()
+            held = queue.acquire() if queue else False
+            try:
+                conn = engine.connect()
+                trans = conn.begin()
+                conn.execute("INSERT INTO comments (post_id, comment, created_date) "
+                             "VALUES (?, ?, CURRENT_TIMESTAMP)",
+                             int(start * 1000) % 100, "benchmark comment")
+                # the second statement of update_num_comments
+                conn.execute("SELECT count(*) FROM comments WHERE post_id = ?",
+                             int(start * 1000) % 100).fetchall()
+                trans.commit()
+                conn.close()
+            except DBAPIError, e:
+                failed(e)
+                continue
+            finally:
+                if held:
+                    queue.release()
+            with lock:
+                stats['writes'] += 1
+                stats['latencies'].append(time.time() - start)
+
+    def guarded(target):
+        try:
+            target()
+        except:
+            traceback.print_exc()
+            with lock:
+                stats['died'] += 1
+
+    threads = [threading.Thread(target=guarded, args=(read,))
+               for i in range(readers)] + \
+              [threading.Thread(target=guarded, args=(write,))
+               for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return stats
+
+def main():
+    parser = OptionParser(usage="%prog [-r READERS] [-w WRITERS] [-s SECONDS]")
+    parser.add_option('-r', '--readers', dest='readers', type='int', default=8)
+    parser.add_option('-w', '--writers', dest='writers', type='int', default=4)
+    parser.add_option('-s', '--seconds', dest='seconds', type='int', default=10)
+    options, args = parser.parse_args()
+
+    print "%d readers, %d writers, %ds each" % (options.readers,
+                                                options.writers,
+                                                options.seconds)
+    print "%-10s %10s %10s %12s %12s %8s %8s" % ("profile", "reads/s",
+                                                 "writes/s", "write p50 ms",
+                                                 "write p99 ms", "locked",
+                                                 "errors")
+
+    died = False
+
+    for name in ("default", "tuned"):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            if name == "default":
+                # a connection per checkout, SQLAlchemy's default for
+                # files since 0.7; the SingletonThreadPool of 0.6 closes
+                # connections other threads are still using
+                engine = create_engine('sqlite:///' + path, poolclass=NullPool)
+                queue = None
+            else:
+                engine = create_engine('sqlite:///' + path,
+                                       **engine_options({'SQLITE_POOL_SIZE':
+                                           options.readers + options.writers}))
+                queue = WriterQueue()
+            engine.execute(SCHEMA)
+
+            stats = run(engine, queue, options.readers, options.writers,
+                        options.seconds)
+
+            print "%-10s %10.1f %10.1f %12.2f %12.2f %8d %8d" % (name,
+                stats['reads'] / float(options.seconds),
+                stats['writes'] / float(options.seconds),
+                percentile(stats['latencies'], 50) * 1000,
+                percentile(stats['latencies'], 99) * 1000,
+                stats['locked'], stats['errors'])
+            if stats['died']:
+                print "%-10s %d threads died, the numbers are not valid" % \
+                      (name, stats['died'])
+                died = True
+            engine.dispose()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    if died:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
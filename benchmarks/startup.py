@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    startup.py
+    ~~~~~~~~~~~~~
+
+    Times a cold start in this interpreter: importing pypress, building
+    the app and serving the first request, with the functions that
+    cost the most and the lazily loaded modules that got imported.
+    Run it in a fresh interpreter (`manage.py startup-profile` does).
+
+    Usage: python benchmarks/startup.py [-c config.cfg] [-u /] [-n 25] [--preload]
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+
+from optparse import OptionParser
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+LAZY = ('pypress.twitter', 'oauth2', 'pygments', 'flaskext.mail', 
+        'flaskext.uploads')
+
+def main():
+    parser = OptionParser(usage="%prog [-c CONFIG] [-u URL] [-n TOP] [--preload]")
+    parser.add_option('-c', '--config', dest='config', default='config.cfg')
+    parser.add_option('-u', '--url', dest='url', default='/')
+    parser.add_option('-n', '--top', dest='top', type='int', default=25)
+    parser.add_option('--preload', dest='preload', action='store_true',
+                      default=False, help="load the lazy modules up front")
+    options, args = parser.parse_args()
+
+    profile = cProfile.Profile()
+    modules = len(sys.modules)
+    timings = []
+
+    start = time.time()
+    profile.enable()
+    import pypress
+    profile.disable()
+    timings.append(("import pypress", time.time() - start))
+
+    start = time.time()
+    profile.enable()
+    app = pypress.create_app(options.config)
+    if options.preload:
+        from pypress import lazy
+        lazy.load_all()
+    profile.disable()
+    timings.append(("create_app", time.time() - start))
+
+    start = time.time()
+    profile.enable()
+    response = app.test_client().get(options.url)
+    profile.disable()
+    timings.append(("first GET %s (%s)" % (options.url, response.status_code),
+                    time.time() - start))
+
+    for name, seconds in timings:
+        print "%-40s %8.1f ms" % (name, seconds * 1000)
+    print "%-40s %8.1f ms" % ("total", sum(s for n, s in timings) * 1000)
+    print "%d modules imported" % (len(sys.modules) - modules)
+    print "lazy modules loaded: %s" % (", ".join(m for m in LAZY 
+                                                 if m in sys.modules) or "none")
+    print
+
+    out = StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.sort_stats('cumulative').print_stats(options.top)
+    print out.getvalue()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    twitter_models.py
+    ~~~~~~~~~~~~~
+
+    Compares eager twitter.Status/User decoding with the lazy models
+    on a synthetic 200-tweet timeline, rendering only the fields used
+    by macros/_twitter.html.
+
+    Usage: python benchmarks/twitter_models.py [-n ROUNDS]
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import gc
+import os
+import sys
+import time
+import json
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pypress import twitter
+
+TIMELINE_SIZE = 200
+
+def make_user(i):
+    return {
+        'id': 1000 + i,
+        'name': u'User %d' % i,
+        'screen_name': u'user%d' % i,
+        'location': u'Shanghai',
+        'description': u'pypress benchmark user',
+        'url': u'http://example.com/%d' % i,
+        'profile_image_url': u'http://example.com/%d.png' % i,
+        'profile_background_tile': False,
+        'profile_background_image_url': u'http://example.com/bg.png',
+        'profile_sidebar_fill_color': u'DDEEF6',
+        'profile_background_color': u'C0DEED',
+        'profile_link_color': u'0084B4',
+        'profile_text_color': u'333333',
+        'protected': False,
+        'utc_offset': 28800,
+        'time_zone': u'Beijing',
+        'statuses_count': 1234,
+        'followers_count': 56,
+        'friends_count': 78,
+        'favourites_count': 9,
+        'geo_enabled': False,
+    }
+
+def make_status(i, retweet=True):
+    status = {
+        'id': 50000 + i,
+        'created_at': u'Sat Jan 27 04:17:38 +0000 2007',
+        'text': u'tweet %d with a #tag and a link http://t.co/%d @user%d' % (i, i, i),
+        'source': u'<a href="http://example.com">pypress</a>',
+        'truncated': False,
+        'favorited': False,
+        'in_reply_to_screen_name': None,
+        'in_reply_to_user_id': None,
+        'in_reply_to_status_id': None,
+        'geo': None,
+        'place': None,
+        'coordinates': None,
+        'contributors': None,
+        'user': make_user(i % 7),
+        'entities': {
+            'urls': [{'url': u'http://t.co/%d' % i,
+                      'expanded_url': u'http://example.com/%d' % i}],
+            'hashtags': [{'text': u'tag'}],
+            'user_mentions': [{'id': 1000 + i, 'screen_name': u'user%d' % i,
+                               'name': u'User %d' % i}],
+        },
+    }
+    if retweet and i % 5 == 0:
+        status['retweeted_status'] = make_status(i + 1, retweet=False)
+    return status
+
+def render(statuses):
+    # the fields read by tweet_box()
+    for status in statuses:
+        status.user.screen_name
+        status.text
+        status.created_at
+        status.source
+
+def run(status_class, payload, rounds):
+    gc.collect()
+    before = len(gc.get_objects())
+    statuses = [status_class.NewFromJsonDict(x) for x in json.loads(payload)]
+    render(statuses)
+    objects = len(gc.get_objects()) - before
+    del statuses
+
+    start = time.time()
+    for i in range(rounds):
+        render([status_class.NewFromJsonDict(x) for x in json.loads(payload)])
+    elapsed = (time.time() - start) / rounds
+
+    return objects, elapsed
+
+def main():
+    parser = OptionParser(usage="%prog [-n ROUNDS]")
+    parser.add_option('-n', '--rounds', dest='rounds', type='int', default=50)
+    options, args = parser.parse_args()
+
+    payload = json.dumps([make_status(i) for i in range(TIMELINE_SIZE)])
+
+    print "%d-tweet timeline, %d rounds" % (TIMELINE_SIZE, options.rounds)
+    print "%-8s %12s %12s" % ("models", "gc objects", "ms/timeline")
+    for name, status_class in (("eager", twitter.Status),
+                               ("lazy", twitter.LazyStatus)):
+        objects, elapsed = run(status_class, payload, options.rounds)
+        print "%-8s %12d %12.2f" % (name, objects, elapsed * 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
-from pypress import create_app
+from pypress import create_app, warm
 
 app = create_app('config.cfg')
+warm.on_boot(app)
 
 from flup.server.fcgi import WSGIServer
 WSGIServer(app,bindAddress='/tmp/pypress.sock').run()
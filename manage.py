@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 #coding=utf-8
 
+import os
+import sys
+import time
 import uuid
+import subprocess
 
 from flask import Flask, current_app
-from flaskext.script import Server, Shell, Manager, Command, prompt_bool
+from flaskext.script import Server, Shell, Manager, Command, Option, prompt_bool
 
-from pypress import create_app
+from pypress import create_app, compress, prefork, warm as warm_
+from pypress import assets as static_assets
+from pypress import bench as bench_
+from pypress import transfer
 from pypress.extensions import db
-from pypress.models.users import User, UserCode
+from pypress.models.users import User, UserCode, Twitter
+from pypress.models.blog import Post, Archive, Comment
 
 manager = Manager(create_app('config.cfg'))
 
@@ -18,6 +26,100 @@ def _make_context():
     return dict(db=db)
 manager.add_command("shell", Shell(make_context=_make_context))
 
+
+class Export(Command):
+    "Writes users, links, posts and comments as JSON lines"
+
+    option_list = (
+        Option('filename', help="output file, - for stdout"),
+        Option('-c', '--chunk', dest='chunk', default=1000, type=int),
+    )
+
+    def run(self, filename, chunk):
+        stream = sys.stdout if filename == '-' else open(filename, 'w')
+        counts = transfer.export(stream, chunk=chunk)
+        if stream is not sys.stdout:
+            stream.close()
+        print >> sys.stderr, ", ".join("%d %ss" % (counts[t], t) 
+                                       for t in transfer.TYPES)
+
+
+class Import(Command):
+    "Loads users, links, posts and comments from JSON lines"
+
+    option_list = (
+        Option('filename', help="input file, - for stdin"),
+        Option('-c', '--chunk', dest='chunk', default=1000, type=int),
+        Option('-w', '--workers', dest='workers', default=None, type=int,
+               help="processes rendering markdown, default one per CPU"),
+    )
+
+    def run(self, filename, chunk, workers):
+        stream = sys.stdin if filename == '-' else open(filename)
+        start = time.time()
+        importer = transfer.Importer(chunk=chunk, workers=workers)
+        counts = importer.load(stream)
+        print ", ".join("%d %ss" % (counts[t], t) for t in transfer.TYPES) + \
+              " imported in %.1fs" % (time.time() - start)
+        if any(importer.skipped.values()):
+            print ", ".join("%d %ss" % (importer.skipped[t], t) 
+                            for t in transfer.TYPES) + " skipped"
+
+
+class StartupProfile(Command):
+    "Profiles a cold start: imports, create_app and the first request"
+
+    option_list = (
+        Option('-u', '--url', dest='url', default='/'),
+        Option('-n', '--top', dest='top', default=25, type=int),
+        Option('--preload', dest='preload', action='store_true', default=False,
+               help="load lazily imported modules up front, as prefork does"),
+    )
+
+    def run(self, url, top, preload):
+        root = os.path.dirname(os.path.abspath(__file__))
+        args = [sys.executable, os.path.join(root, 'benchmarks', 'startup.py'),
+                '-u', url, '-n', str(top)]
+        if preload:
+            args.append('--preload')
+        # a fresh interpreter, this one has imported everything already
+        subprocess.call(args, cwd=root)
+
+
+class Serve(Command):
+    "Serves with preforked, threaded workers (settings SERVER_* in config.cfg)"
+
+    option_list = (
+        Option('-H', '--host', dest='host', default='127.0.0.1'),
+        Option('-p', '--port', dest='port', default=8080, type=int),
+        Option('-w', '--workers', dest='workers', default=None, type=int),
+        Option('-t', '--threads', dest='threads', default=None, type=int,
+               help="threads per worker, at most SQLITE_POOL_SIZE with SQLite"),
+        Option('--max-requests', dest='max_requests', default=None, type=int,
+               help="requests before a worker is replaced, 0 for never"),
+        Option('--timeout', dest='timeout', default=None, type=int,
+               help="seconds an idle connection is kept"),
+        Option('--graceful-timeout', dest='graceful_timeout', default=None, 
+               type=int),
+        Option('--preload', dest='preload', action='store_true', default=None,
+               help="build and warm the app once, before forking"),
+        Option('--no-preload', dest='preload', action='store_false', 
+               default=None),
+    )
+
+    def handle(self, app, *args, **kwargs):
+        # forked workers must not start inside this command's request
+        self.run(*args, **kwargs)
+
+    def run(self, host, port, **options):
+        prefork.serve('config.cfg', host, port, **options)
+
+
+manager.add_command("export", Export())
+manager.add_command("import", Import())
+manager.add_command("startup-profile", StartupProfile())
+manager.add_command("serve", Serve())
+
 @manager.command
 def createall():
     "Creates database tables"
@@ -30,6 +132,111 @@ def dropall():
     if prompt_bool("Are you sure ? You will lose all your data !"):
         db.drop_all()
 
+@manager.command
+def archives():
+    "Recounts the monthly archive summary from the posts table"
+    print "%d months with posts" % Archive.query.rebuild()
+
+@manager.command
+def email_hashes():
+    "Stores the gravatar hash of users and comments written before it was kept"
+    count = 0
+    for model in (User, Comment):
+        column = model.__table__.c.email_hash
+        for obj in model.query.filter(column==None).filter(model.email!=None):
+            # the mapper extension fills in email_hash on flush
+            obj.email_hash = ''
+            count += 1
+    db.session.commit()
+    print "%d email hashes stored" % count
+
+@manager.command
+def twitter_names():
+    "Stores the screen name of twitter tokens saved without one"
+    count = 0
+    for user in User.query.join(User.twitter).filter(Twitter.screen_name==None):
+        api = user.twitter_api
+        if api and user.twitter.refresh_screen_name(api):
+            count += 1
+    db.session.commit()
+    print "%d screen names stored" % count
+
+@manager.command
+def compress_static():
+    "Precompresses static and theme assets (.gz/.br next to each file)"
+    app = current_app
+    count = 0
+    for directory in (os.path.join(app.root_path, 'static'),
+                      os.path.join(app.root_path, 'themes')):
+        count += compress.precompress_tree(directory)
+    print "%d compressed files written" % count
+
+@manager.command
+def assets():
+    "Builds fingerprinted, minified static files and bundles and their manifest"
+    result = static_assets.build(current_app)
+    for root in sorted(result):
+        print "%s: %d files" % (root, len(result[root]))
+    compress_static()
+
+@manager.option('-l', '--log', dest='log', default=None, 
+                help="access log ranking the pages, default WARM_ACCESS_LOG")
+@manager.option('-p', '--posts', dest='posts', default=None, type=int)
+@manager.option('-t', '--tags', dest='tags', default=None, type=int)
+@manager.option('-w', '--threads', dest='threads', default=None, type=int)
+def warm(log, posts, tags, threads):
+    "Fills the cache with the sidebar, feeds, hot posts and tag pages"
+    cache_type = current_app.config.get('CACHE_TYPE', 'null')
+    if cache_type in ('null', 'simple'):
+        print "CACHE_TYPE %s is local to this process, " \
+              "set WARM_ON_BOOT to warm the server instead" % cache_type
+    # the warming threads have no request context to resolve the proxy
+    app = current_app._get_current_object()
+    requests, errors, seconds = warm_.run(app, posts=posts, tags=tags,
+                                          threads=threads, log=log)
+    print "%d pages warmed in %.1fs, %d errors" % (requests, seconds, errors)
+
+@manager.option('-d', '--database', dest='database', default='sqlite://')
+@manager.option('-u', '--users', dest='users', default=10, type=int)
+@manager.option('-p', '--posts', dest='posts', default=500, type=int)
+@manager.option('-c', '--comments', dest='comments', default=5000, type=int)
+@manager.option('-t', '--tags', dest='tags', default=200, type=int)
+@manager.option('-n', '--requests', dest='requests', default=1000, type=int)
+@manager.option('-s', '--seed', dest='seed', default=0, type=int)
+@manager.option('--nocache', dest='nocache', action='store_true', default=False)
+@manager.option('--baselines', dest='baselines', default='benchmarks/baselines.json')
+@manager.option('--save', dest='save', default=None)
+@manager.option('--compare', dest='compare', default=None)
+def bench(database, users, posts, comments, tags, requests, seed, nocache, 
+          baselines, save, compare):
+    "Replays the main routes against a synthetic blog and reports timings"
+    app = current_app
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    app.config['SQLALCHEMY_COUNT_QUERIES'] = True
+    app.config['SQLALCHEMY_ECHO'] = False
+
+    db.create_all()
+    if Post.query.count() == 0:
+        start = time.time()
+        bench_.generate(users=users, posts=posts, comments=comments, 
+                        tags=tags, seed=seed)
+        print "generated %d posts, %d comments in %.1fs" % (posts, comments, 
+                                                            time.time() - start)
+
+    plan = bench_.request_plan(requests, seed=seed)
+    results = bench_.run(app, plan, clear_cache=nocache)
+
+    baseline = None
+    if compare:
+        baseline = bench_.load_baselines(baselines).get(compare)
+        if baseline is None:
+            print "no baseline named %s in %s" % (compare, baselines)
+    bench_.report(results, baseline)
+
+    if save:
+        bench_.save_baseline(baselines, save, results)
+        print "saved as %s in %s" % (save, baselines)
+
 @manager.option('-r', '--role', dest='role', default="member")
 @manager.option('-n', '--number', dest='number', default=1, type=int)
 def createcode(role, number):
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+import sys
+
+from pypress.prefork import main
+
+main(sys.argv[1:])
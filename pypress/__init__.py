@@ -9,22 +9,24 @@
 """
 import os
 import logging
-import datetime
 
 from logging.handlers import SMTPHandler, RotatingFileHandler
 from werkzeug import parse_date
 
-from flask import Flask, g, session, request, flash, redirect, jsonify, url_for
+from babel import support
 
-from flaskext.babel import Babel, gettext as _
+from flask import Flask, g, session, request, flash, redirect, jsonify, url_for, \
+    _request_ctx_stack
+
+from flaskext.babel import Babel, gettext as _, get_locale as babel_locale
 from flaskext.themes import setup_themes
 from flaskext.principal import Principal, RoleNeed, UserNeed, identity_loaded
-from flaskext.uploads import configure_uploads
 
-from pypress import views, helpers
-from pypress.models import User, Post, Tag, Link, Comment
-from pypress.extensions import db, mail, cache, photos
-from pypress.helpers import render_template
+from pypress import views, helpers, compress, assets, queries, lazy
+from pypress.models import User, Post, Tag, Link, Comment, Archive
+from pypress.models.users import identity_cache
+from pypress.extensions import db, mail, cache, photos, passwords
+from pypress.helpers import render_template, LRUCache
 
 DEFAULT_APP_NAME = 'pypress'
 
@@ -55,7 +57,12 @@ def create_app(config=None, modules=None):
     configure_before_handlers(app)
     configure_template_filters(app)
     configure_context_processors(app)
-    configure_uploads(app, (photos,))
+    photos.init_app(app)
+    if not app.config.get('UPLOADS_DEFAULT_URL'):
+        # uploads are served by the app, their routes must exist up front
+        lazy.load(photos)
+    compress.init_app(app)
+    assets.init_app(app)
 
     configure_i18n(app)
     
@@ -68,8 +75,10 @@ def create_app(config=None, modules=None):
 def configure_extensions(app):
     # configure extensions          
     db.init_app(app)
+    queries.init_app(app)
     mail.init_app(app)
     cache.init_app(app)
+    passwords.init_app(app)
     setup_themes(app)
 
 
@@ -77,6 +86,8 @@ def configure_identity(app):
 
     principal = Principal(app)
 
+    identity_cache.timeout = app.config.get('IDENTITY_CACHE_TIMEOUT', 60)
+
     @identity_loaded.connect_via(app)
     def on_identity_loaded(sender, identity):
         g.user = User.query.from_identity(identity)
@@ -86,10 +97,31 @@ def configure_i18n(app):
 
     babel = Babel(app)
 
+    accept_languages = app.config.get('ACCEPT_LANGUAGES',['en','zh'])
+
+    # best match of each distinct Accept-Language header seen, '' for none
+    locales = LRUCache(maxsize=app.config.get('LOCALE_CACHE_SIZE', 500))
+
+    # catalogs are loaded once per worker instead of once per request
+    dirname = os.path.join(app.root_path, 'translations')
+    translations = {}
+    for locale in set(accept_languages + [app.config['BABEL_DEFAULT_LOCALE']]):
+        translations[locale] = support.Translations.load(dirname, [locale])
+
     @babel.localeselector
     def get_locale():
-        accept_languages = app.config.get('ACCEPT_LANGUAGES',['en','zh'])
-        return request.accept_languages.best_match(accept_languages)
+        header = request.headers.get('Accept-Language', '')
+        locale = locales.get(header)
+        if locale is None:
+            locale = request.accept_languages.best_match(accept_languages) or ''
+            locales.set(header, locale)
+        return locale or None
+
+    @app.before_request
+    def preloaded_translations():
+        catalog = translations.get(str(babel_locale()))
+        if catalog is not None:
+            _request_ctx_stack.top.babel_translations = catalog
 
 
 def configure_context_processors(app):
@@ -114,26 +146,8 @@ def configure_context_processors(app):
     def archives():
         archives = cache.get("archives")
         if archives is None:
-            begin_post = Post.query.order_by('created_date').first()
-            
-            now = datetime.datetime.now()
-
-            begin = begin_post.created_date if begin_post else now
-            end = now
-
-            total = (end.year-begin.year)*12 - begin.month + end.month
-            archives = [begin]
-
-            date = begin
-            for i in range(total):
-                if date.month<12: 
-                    date = datetime.datetime(date.year,date.month+1,1)
-                else:
-                    date = datetime.datetime(date.year+1, 1, 1)
-                archives.append(date)
-            archives.reverse()
+            archives = Archive.query.months()
             cache.set("archives", archives)
-        
         return dict(archives=archives)
 
     @app.context_processor
@@ -164,6 +178,10 @@ def configure_template_filters(app):
     def gravatar(email,size):
         return helpers.gravatar(email,size)
 
+    @app.template_filter()
+    def avatar(email_hash,size):
+        return helpers.gravatar.link(email_hash,size)
+
     @app.template_filter()
     def format_date(date,s='full'):
         return helpers.format_date(date,s)
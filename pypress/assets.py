@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    assets.py
+    ~~~~~~~~~~~~~
+
+    Fingerprinted static assets. `manage.py assets` copies every file of
+    the app and theme static folders to name.<hash>.ext, minifies CSS,
+    builds the bundles and writes a manifest. Templates then get the
+    hashed URLs, served with far-future, immutable cache headers.
+
+    JS is minified only when rjsmin is installed, and copied as is
+    otherwise; there are no JS bundles, only THEME_BUNDLES of CSS.
+
+    A build keeps the files of the previous one, which servers that
+    have not been restarted, cached pages and proxies still link to,
+    and removes older ones.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import re
+import json
+import hashlib
+
+from flask import request, url_for
+from flaskext.themes import static_file_url
+
+from pypress.helpers import get_theme
+from pypress.compress import IMMUTABLE, IMMUTABLE_RE
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+# bundles of theme static files, built in this order
+THEME_BUNDLES = (
+    ('all.css', ('style.css', 'highlight.css')),
+)
+
+_css_comment_re = re.compile(r'/\*.*?\*/', re.S)
+_css_space_re = re.compile(r'\s*([{};,>])\s*')
+_css_url_re = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# loaded by init_app: {root: {filename: fingerprinted filename}}
+manifest = {}
+
+def is_fingerprinted(path):
+    return IMMUTABLE_RE.search(path) is not None
+
+def fingerprint(filename, data):
+    name, ext = os.path.splitext(filename)
+    return "%s.%s%s" % (name, hashlib.md5(data).hexdigest()[:10], ext)
+
+def minify_css(css):
+    css = _css_comment_re.sub('', css)
+    css = _css_space_re.sub(r'\1', css)
+    css = re.sub(r'\s+', ' ', css)
+    return css.replace(';}', '}').strip()
+
+def minify_js(js):
+    if rjsmin is None:
+        return js
+    return rjsmin.jsmin(js)
+
+def minify(filename, data):
+    if '.min.' in filename:
+        return data
+    if filename.endswith('.css'):
+        return minify_css(data)
+    if filename.endswith('.js'):
+        return minify_js(data)
+    return data
+
+def rewrite_css_urls(css, files):
+    """
+    Points relative url()s of css at their fingerprinted files.
+    """
+    def replace(match):
+        quote, target = match.groups()
+        if target in files:
+            return 'url(%s%s%s)' % (quote, files[target], quote)
+        return match.group(0)
+    return _css_url_re.sub(replace, css)
+
+def source_files(directory):
+    """
+    Yields the file names under directory, relative to it, skipping
+    build output.
+    """
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            if is_fingerprinted(name) or name.endswith(('.gz', '.br')):
+                continue
+            filename = os.path.join(root, name)
+            yield os.path.relpath(filename, directory).replace(os.sep, '/')
+
+def write_file(directory, filename, data):
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+
+def build_root(directory, bundles=(), keep=()):
+    """
+    Fingerprints the files of one static folder and builds its bundles.
+    Returns the manifest of the folder and removes the output of
+    earlier builds, except the fingerprinted files of keep.
+    """
+    files = {}
+    contents = {}
+
+    # stylesheets last, so their url()s can be rewritten
+    names = sorted(source_files(directory), key=lambda n: (n.endswith('.css'), n))
+
+    for filename in names:
+        f = open(os.path.join(directory, filename), 'rb')
+        data = minify(filename, f.read())
+        f.close()
+
+        if filename.endswith('.css'):
+            base = os.path.dirname(filename)
+            relative = dict((os.path.relpath(k, base or '.').replace(os.sep, '/'),
+                             os.path.relpath(v, base or '.').replace(os.sep, '/'))
+                            for k, v in files.items())
+            data = rewrite_css_urls(data, relative)
+
+        contents[filename] = data
+        files[filename] = fingerprint(filename, data)
+        write_file(directory, files[filename], data)
+
+    for bundle, members in bundles:
+        data = '\n'.join(contents[m] for m in members if m in contents)
+        files[bundle] = fingerprint(bundle, data)
+        write_file(directory, files[bundle], data)
+
+    outputs = set(files.values()) | set(keep)
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            filename = os.path.relpath(os.path.join(root, name), 
+                                       directory).replace(os.sep, '/')
+            base = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+            if is_fingerprinted(base) and base not in outputs:
+                os.remove(os.path.join(root, name))
+
+    return files
+
+def manifest_path(app):
+    return os.path.join(app.root_path, 
+                        app.config.get('ASSETS_MANIFEST', 'assets.json'))
+
+def build(app):
+    """
+    Builds every static folder of the app and writes the manifest.
+    """
+    previous = {}
+    if os.path.exists(manifest_path(app)):
+        f = open(manifest_path(app))
+        previous = json.load(f)
+        f.close()
+
+    def keep(root):
+        return previous.get(root, {}).values()
+
+    result = {'static': build_root(os.path.join(app.root_path, 'static'),
+                                   keep=keep('static'))}
+
+    themes_dir = os.path.join(app.root_path, 'themes')
+    for theme in os.listdir(themes_dir):
+        static_dir = os.path.join(themes_dir, theme, 'static')
+        if os.path.isdir(static_dir):
+            root = 'theme/' + theme
+            result[root] = build_root(static_dir, THEME_BUNDLES, keep(root))
+
+    f = open(manifest_path(app), 'w')
+    json.dump(result, f, indent=2, sort_keys=True)
+    f.close()
+
+    manifest.clear()
+    manifest.update(result)
+    return result
+
+def theme_static(filename, external=False):
+    """
+    URL of a theme static file, fingerprinted when built.
+    """
+    theme = get_theme()
+    filename = manifest.get('theme/' + theme, {}).get(filename, filename)
+    return static_file_url(theme, filename, external)
+
+def theme_bundle(bundle):
+    """
+    URLs to include for a theme bundle: the built bundle, or its 
+    members when assets have not been built.
+    """
+    files = manifest.get('theme/' + get_theme(), {})
+    if bundle in files:
+        return [theme_static(bundle)]
+    members = dict(THEME_BUNDLES).get(bundle, ())
+    return [theme_static(m) for m in members]
+
+def asset_url_for(endpoint, **values):
+    """
+    url_for for templates: static files resolve to fingerprinted names.
+    """
+    if endpoint in ('.static', 'static') and 'filename' in values:
+        values['filename'] = manifest.get('static', {}).get(values['filename'], 
+                                                            values['filename'])
+    return url_for(endpoint, **values)
+
+def set_cache_headers(response):
+    if request.endpoint in ('static', '_themes.static') and \
+            response.status_code in (200, 304) and \
+            is_fingerprinted(request.path):
+        response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+def init_app(app):
+    manifest.clear()
+    path = manifest_path(app)
+    if os.path.exists(path):
+        f = open(path)
+        manifest.update(json.load(f))
+        f.close()
+
+    app.jinja_env.globals.update(theme_static=theme_static,
+                                 theme_bundle=theme_bundle,
+                                 url_for=asset_url_for)
+    app.after_request(set_cache_headers)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    bench.py
+    ~~~~~~~~~~~~~
+
+    End-to-end benchmark behind `manage.py bench`: a reproducible
+    synthetic blog, an in-process driver over the main routes and a
+    report of throughput, latency percentiles, queries per request
+    and memory, compared against stored baselines.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import gc
+import json
+import time
+import bisect
+import random
+import resource
+
+from datetime import datetime, timedelta
+
+from pypress.extensions import db, cache, passwords
+from pypress.queries import collect
+from pypress.models import User, Post, Comment, Tag, Link
+
+WORDS = ("flask", "python", "blog", "cache", "query", "template", "theme",
+         "server", "request", "session", "index", "feed", "tag", "comment",
+         "markdown", "unicode", "thread", "worker", "database", "sqlite",
+         "mysql", "nginx", "deploy", "profile", "memory", "latency", "locale",
+         "babel", "twitter", "gravatar", "archive", "search", "page", "route",
+         "module", "signal", "model", "mapper", "engine", "pool", "socket",
+         "json", "atom", "static", "asset", "upload", "image", "mail", "login")
+
+CODE = '''def fib(n):
+    a, b = 0, 1
+    for i in range(n):
+        a, b = b, a + b
+    return a
+
+print [fib(i) for i in range(%d)]'''
+
+# share of requests per route
+ROUTES = (
+    ('index', 30),
+    ('post', 30),
+    ('tag', 10),
+    ('search', 8),
+    ('archive', 5),
+    ('feed', 12),
+    ('links', 5),
+)
+
+
+class Zipf(object):
+    """
+    Draws 0..n-1 with probability proportional to 1 / (k + 1) ** s.
+    """
+
+    def __init__(self, rnd, n, s=1.1):
+        self.rnd = rnd
+        self.cumulative = []
+        total = 0.0
+        for k in range(1, n + 1):
+            total += 1.0 / k ** s
+            self.cumulative.append(total)
+
+    def __call__(self):
+        x = self.rnd.random() * self.cumulative[-1]
+        return bisect.bisect_left(self.cumulative, x)
+
+
+def sentence(rnd, words=12):
+    return " ".join(rnd.choice(WORDS) for i in range(words)).capitalize() + "."
+
+def post_content(rnd, num):
+    """
+    Editor HTML as stored by the post form: paragraphs, a read more
+    marker and highlighted code blocks.
+    """
+    parts = ["<p>%s</p>" % sentence(rnd, rnd.randint(20, 60))
+             for i in range(rnd.randint(1, 3))]
+    parts.append('<p id="more-%d"></p>' % num)
+    for i in range(rnd.randint(2, 8)):
+        parts.append("<p>%s</p>" % sentence(rnd, rnd.randint(20, 80)))
+        if rnd.random() < 0.4:
+            parts.append('<pre l="python">%s</pre>' % (CODE % rnd.randint(5, 50)))
+    return u"\n".join(parts)
+
+def comment_content(rnd):
+    """
+    Markdown, as comments are written.
+    """
+    text = sentence(rnd, rnd.randint(5, 40))
+    if rnd.random() < 0.2:
+        text += "\n\n    " + (CODE % rnd.randint(5, 50)).replace("\n", "\n    ")
+    if rnd.random() < 0.2:
+        text += "\n\n* %s\n* %s" % (sentence(rnd, 4), sentence(rnd, 4))
+    return text
+
+
+def generate(users=10, posts=500, comments=5000, tags=200, links=20, seed=0):
+    """
+    Fills the database with a synthetic blog. The same arguments and
+    seed always produce the same data.
+    """
+    rnd = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+
+    # synthetic users never log in, hash their password once
+    password = passwords.hash("bench")
+
+    authors = []
+    for i in range(users):
+        user = User(username="bench%d" % i,
+                    nickname="Bench %d" % i,
+                    email="bench%d@example.com" % i,
+                    role=User.MEMBER)
+        user._password = password
+        db.session.add(user)
+        authors.append(user)
+    db.session.commit()
+
+    tag_names = ["%s%d" % (WORDS[i % len(WORDS)], i) for i in range(tags)]
+    pick_tag = Zipf(rnd, tags)
+    pick_post = Zipf(rnd, posts)
+
+    all_posts = []
+    for i in range(posts):
+        # spread over three years, newest last
+        created = now - timedelta(days=3 * 365 * (posts - i) / posts,
+                                  seconds=rnd.randint(0, 86400))
+        post_tags = set(tag_names[pick_tag()] for t in range(rnd.randint(1, 5)))
+        post = Post(author=rnd.choice(authors),
+                    title=u"%s %d" % (sentence(rnd, rnd.randint(3, 8))[:-1], i),
+                    content=post_content(rnd, i),
+                    created_date=created,
+                    update_time=created)
+        post.tags = u", ".join(sorted(post_tags))
+        db.session.add(post)
+        all_posts.append(post)
+        # the session does not autoflush, and the next posts look up
+        # the tags added by this one
+        db.session.flush()
+        if i % 100 == 99:
+            db.session.commit()
+    db.session.commit()
+
+    threads = {}
+    for i in range(comments):
+        post = all_posts[posts - 1 - pick_post()]
+        thread = threads.setdefault(post.id, [])
+        comment = Comment(post=post,
+                          comment=comment_content(rnd),
+                          created_date=post.created_date +
+                                       timedelta(minutes=rnd.randint(1, 60 * 24 * 30)))
+        if rnd.random() < 0.7:
+            comment.author = rnd.choice(authors)
+        else:
+            comment.email = "guest%d@example.com" % rnd.randint(0, 1000)
+            comment.nickname = u"guest"
+        if thread and rnd.random() < 0.4:
+            comment.parent = rnd.choice(thread)
+        db.session.add(comment)
+        thread.append(comment)
+        post.num_comments = len(thread)
+        if i % 500 == 499:
+            db.session.commit()
+    db.session.commit()
+
+    for i in range(links):
+        db.session.add(Link(name=u"link %d" % i,
+                            link="http://example.com/%d" % i,
+                            passed=True))
+    db.session.commit()
+
+    return dict(users=users, posts=posts, comments=comments,
+                tags=tags, links=links)
+
+
+def request_plan(requests, seed=0):
+    """
+    Returns a reproducible list of (route, url) to replay, with hot
+    posts and tags drawn from a Zipf distribution.
+    """
+    rnd = random.Random(seed)
+
+    posts = Post.query.order_by(Post.id.desc()).all()
+    tag_slugs = [slug for slug, num in
+                 db.session.query(Tag.slug, Tag.num_posts) \
+                           .order_by(Tag.num_posts.desc()).all()]
+
+    pick_post = Zipf(rnd, len(posts))
+    pick_tag = Zipf(rnd, len(tag_slugs))
+
+    routes = []
+    for name, weight in ROUTES:
+        routes.extend([name] * weight)
+
+    plan = []
+    for i in range(requests):
+        route = rnd.choice(routes)
+        if route == 'index':
+            url = "/" if rnd.random() < 0.8 else "/page/%d/" % rnd.randint(2, 5)
+        elif route == 'post':
+            url = posts[pick_post()].url
+        elif route == 'tag':
+            url = "/tags/%s/" % tag_slugs[pick_tag()]
+        elif route == 'search':
+            url = "/search/?q=%s" % rnd.choice(WORDS)
+        elif route == 'archive':
+            url = "/archive/"
+        elif route == 'feed':
+            url = "/feeds/" if rnd.random() < 0.7 else \
+                  "/feeds/tag/%s/" % tag_slugs[pick_tag()]
+        else:
+            url = "/link/"
+        plan.append((route, url))
+
+    return plan
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def max_rss():
+    """
+    Peak resident memory of the process, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(app, plan, warmup=50, clear_cache=False):
+    """
+    Replays the plan through the WSGI app in process. Returns the
+    results per route and in total.
+    """
+    client = app.test_client()
+
+    for route, url in plan[:warmup]:
+        client.get(url).data
+
+    timings = {}
+    counts = {}
+    errors = {}
+
+    gc.collect()
+    start = time.time()
+
+    for route, url in plan:
+        if clear_cache:
+            cache.cache.clear()
+        t = time.time()
+        with collect() as log:
+            response = client.get(url)
+            # consume streamed bodies too
+            response.data
+        timings.setdefault(route, []).append(time.time() - t)
+        counts.setdefault(route, []).append(log.count)
+        if response.status_code >= 400:
+            errors[route] = errors.get(route, 0) + 1
+
+    elapsed = time.time() - start
+
+    results = {}
+    for route, values in timings.items():
+        results[route] = summarize(values, counts[route], errors.get(route, 0))
+
+    all_timings = sum(timings.values(), [])
+    all_counts = sum(counts.values(), [])
+    results['total'] = summarize(all_timings, all_counts, sum(errors.values()))
+    results['total']['rps'] = len(plan) / elapsed
+    results['total']['max_rss'] = max_rss()
+
+    return results
+
+def summarize(timings, counts, errors):
+    return dict(requests=len(timings),
+                rps=len(timings) / sum(timings),
+                p50=percentile(timings, 50) * 1000,
+                p90=percentile(timings, 90) * 1000,
+                p99=percentile(timings, 99) * 1000,
+                queries=float(sum(counts)) / len(counts),
+                errors=errors)
+
+
+def load_baselines(filename):
+    if not os.path.exists(filename):
+        return {}
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def save_baseline(filename, name, results):
+    baselines = load_baselines(filename)
+    baselines[name] = results
+    f = open(filename, 'w')
+    json.dump(baselines, f, indent=2, sort_keys=True)
+    f.close()
+
+def report(results, baseline=None):
+    """
+    Prints the results, with the change against a baseline when one
+    is given. Returns the lines printed.
+    """
+    lines = ["%-10s %8s %9s %9s %9s %9s %8s %6s" % ("route", "requests",
+             "req/s", "p50 ms", "p90 ms", "p99 ms", "queries", "errors")]
+
+    names = sorted(r for r in results if r != 'total') + ['total']
+    for name in names:
+        r = results[name]
+        line = "%-10s %8d %9.1f %9.2f %9.2f %9.2f %8.1f %6d" % (name,
+            r['requests'], r['rps'], r['p50'], r['p90'], r['p99'],
+            r['queries'], r['errors'])
+        if baseline and name in baseline:
+            b = baseline[name]
+            line += "   p50 %+.0f%%, queries %+.1f" % (
+                (r['p50'] / b['p50'] - 1) * 100, r['queries'] - b['queries'])
+        lines.append(line)
+
+    lines.append("peak memory: %.1f MB" % results['total']['max_rss'])
+
+    for line in lines:
+        print line
+    return lines
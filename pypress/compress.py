@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    compress.py
+    ~~~~~~~~~~~~~
+
+    Compressed delivery: static assets are compressed once into
+    siblings (style.css.gz) and cached responses keep their compressed 
+    bodies. With COMPRESS_DYNAMIC the other text responses are gzipped
+    on the way out too, on every request; it is off by default, leave
+    that to the front server if it can.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import re
+import gzip
+import mimetypes
+import tempfile
+
+from StringIO import StringIO
+
+from werkzeug import Request, Response, wrap_file, parse_accept_header
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 
+                      'application/x-javascript', 'application/json',
+                      'application/atom+xml', 'application/xml', 
+                      'image/svg+xml')
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.html', '.htm', '.xml', 
+                           '.txt', '.json', '.svg', '.ico')
+
+# preferred first
+SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+# fingerprinted assets (see assets.py) never change under their URL
+IMMUTABLE = 'public, max-age=31536000, immutable'
+IMMUTABLE_RE = re.compile(r'\.[0-9a-f]{10}(\.\w+)$')
+
+def encodings():
+    """
+    Returns the content codings available, preferred first.
+    """
+    if brotli is None:
+        return ('gzip',)
+    return ('br', 'gzip')
+
+def gzip_data(data, level=9):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+def compress_data(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip_data(data)
+
+def compress_variants(data):
+    """
+    Returns a dict of the compressed bodies of data, by content coding.
+    """
+    return dict((encoding, compress_data(data, encoding)) \
+                for encoding in encodings())
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def best_encoding(accept_encodings, available):
+    for encoding in encodings():
+        if encoding in available and encoding in accept_encodings:
+            return encoding
+    return None
+
+def precompressed_response(body, variants, mimetype, etag=None):
+    """
+    Builds a response for the current request from a body compressed 
+    ahead of time (see compress_variants).
+    """
+    encoding = best_encoding(request.accept_encodings, variants)
+
+    response = current_app.response_class(
+        variants[encoding] if encoding else body, mimetype=mimetype)
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+
+    if etag:
+        # a representation per coding
+        response.set_etag('%s-%s' % (etag, encoding or 'identity'))
+        response = response.make_conditional(request)
+
+    return response
+
+def compress_response(response):
+    """
+    after_request hook gzipping text responses that are not compressed
+    or cached compressed already, for COMPRESS_DYNAMIC.
+    """
+    if response.status_code != 200 \
+            or response.direct_passthrough \
+            or not response.is_sequence \
+            or 'Content-Encoding' in response.headers \
+            or not is_compressible(response.mimetype) \
+            or 'gzip' not in request.accept_encodings:
+        return response
+
+    data = response.data
+    if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+        return response
+
+    response.data = gzip_data(data, current_app.config.get('COMPRESS_LEVEL', 6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+
+    etag, weak = response.get_etag()
+    if etag:
+        # not the ETag of the identity body
+        response.set_etag('%s-gzip' % etag, weak)
+    return response
+
+def precompress_file(filename, encoding):
+    """
+    Returns the path of the compressed sibling of filename, creating or
+    refreshing it when older than the file. Returns None if it can't be
+    written.
+    """
+    path = filename + dict(SUFFIXES)[encoding]
+    try:
+        mtime = os.path.getmtime(filename)
+        if os.path.exists(path) and os.path.getmtime(path) >= mtime:
+            return path
+
+        f = open(filename, 'rb')
+        data = compress_data(f.read(), encoding)
+        f.close()
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filename))
+        out = os.fdopen(fd, 'wb')
+        out.write(data)
+        out.close()
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        return None
+    return path
+
+def precompress_tree(directory):
+    """
+    Compresses every static asset under directory ahead of time.
+    Returns the number of files written or refreshed.
+    """
+    count = 0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            filename = os.path.join(root, name)
+            for encoding in encodings():
+                path = filename + dict(SUFFIXES)[encoding]
+                fresh = os.path.exists(path) and \
+                        os.path.getmtime(path) >= os.path.getmtime(filename)
+                if not fresh and precompress_file(filename, encoding):
+                    count += 1
+    return count
+
+
+class StaticCompressor(object):
+    """
+    WSGI middleware serving the precompressed siblings of static 
+    assets, compressing them on first request if the build step has
+    not. Other requests pass through, with Vary: Accept-Encoding added
+    for compressible assets.
+
+    :param app: the wrapped WSGI application
+    :param exports: (url prefix, resolve) pairs, where resolve maps 
+                    the rest of the path to a file name
+    :param max_age: Cache-Control max-age of compressed assets
+    """
+
+    def __init__(self, app, exports, max_age=43200):
+        self.app = app
+        self.exports = exports
+        self.max_age = max_age
+
+    def resolve(self, path):
+        if '..' in path:
+            return None
+        for prefix, resolve in self.exports:
+            if path.startswith(prefix):
+                filename = resolve(path[len(prefix):])
+                if filename and \
+                   os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS and \
+                   os.path.isfile(filename):
+                    return filename
+        return None
+
+    def __call__(self, environ, start_response):
+        filename = self.resolve(environ.get('PATH_INFO', ''))
+        if filename is None:
+            return self.app(environ, start_response)
+
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+
+        encoding = best_encoding(accept, encodings())
+        path = encoding and precompress_file(filename, encoding)
+
+        if not path:
+            def vary_start_response(status, headers, exc_info=None):
+                headers.append(('Vary', 'Accept-Encoding'))
+                return start_response(status, headers, exc_info)
+            return self.app(environ, vary_start_response)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        mtime = os.path.getmtime(filename)
+
+        response = Response(wrap_file(environ, open(path, 'rb')),
+                            mimetype=mimetype,
+                            direct_passthrough=True)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.content_length = os.path.getsize(path)
+        response.last_modified = int(mtime)
+        response.cache_control.public = True
+        if IMMUTABLE_RE.search(filename):
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.cache_control.max_age = self.max_age
+        response.set_etag('%d-%d-%s' % (mtime, os.path.getsize(filename), encoding))
+        response = response.make_conditional(Request(environ))
+
+        return response(environ, start_response)
+
+
+def static_exports(app):
+    """
+    Returns the (url prefix, resolve) pairs of the app's static 
+    folder and of the theme static folders.
+    """
+    static_dir = os.path.join(app.root_path, 'static')
+    themes_dir = os.path.join(app.root_path, 'themes')
+
+    def static_file(filename):
+        return os.path.join(static_dir, filename)
+
+    def theme_file(path):
+        theme, sep, filename = path.partition('/')
+        if not sep:
+            return None
+        return os.path.join(themes_dir, theme, 'static', filename)
+
+    return [('/static/', static_file), ('/_themes/', theme_file)]
+
+def init_app(app):
+    app.wsgi_app = StaticCompressor(app.wsgi_app, 
+                                    static_exports(app),
+                                    app.config.get('STATIC_MAX_AGE', 43200))
+
+    if app.config.get('COMPRESS_DYNAMIC', False):
+        app.after_request(compress_response)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    database.py
+    ~~~~~~~~~~~~~
+
+    SQLite deployment profile. File databases get WAL journaling,
+    synchronous=NORMAL, a bounded mmap and a busy timeout on every
+    connection, a fixed pool of connections per worker, and the write
+    transactions of a worker go one at a time through a writer queue,
+    from their first write to their commit, so that readers never
+    wait on writers and writers wait in line instead of failing with
+    "database is locked".
+
+    Writes waiting in line can make commits slower and rarer than with
+    the defaults; benchmarks/sqlite_concurrency.py measures both on a
+    given machine. Set SQLITE_TUNING = False to keep SQLAlchemy's
+    defaults.
+
+    Read replicas: with SQLALCHEMY_REPLICAS set, GET requests to the
+    endpoints of SQLALCHEMY_READ_ENDPOINTS read from one replica per
+    request, everything else uses the primary. A request reads from
+    the primary once it has written, and the client that wrote for
+    SQLALCHEMY_STICKY_SECONDS afterwards, so it sees its own posts and
+    comments before replication does.
+
+    RoutingSession and EngineConnector extend private classes of
+    flaskext.sqlalchemy, so requirements.txt pins the releases they
+    are known to work with.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import time
+import random
+import Queue
+import threading
+
+from fnmatch import fnmatch
+from functools import partial
+
+import sqlalchemy
+
+from sqlalchemy import orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.interfaces import PoolListener
+from sqlalchemy.orm.interfaces import SessionExtension
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import _TextClause
+
+try:
+    from sqlalchemy.sql.expression import UpdateBase
+except ImportError:
+    # SQLAlchemy 0.6
+    from sqlalchemy.sql.expression import _UpdateBase as UpdateBase
+
+from flask import session as client_session, _request_ctx_stack
+
+from flaskext.sqlalchemy import SQLAlchemy as BaseSQLAlchemy, _SignallingSession, \
+    _EngineConnector, _ConnectionDebugProxy, _record_queries
+
+from pypress import queries
+
+DEFAULTS = {
+    'SQLITE_TUNING': True,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_MMAP_SIZE': 64 * 1024 * 1024,
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_POOL_SIZE': 5,
+    'SQLITE_WRITE_TIMEOUT': 10,
+}
+
+READ_ENDPOINTS = ('frontend.*', 'feeds.*', 'link.index')
+
+
+class SQLitePragmas(PoolListener):
+    """
+    Applies the profile pragmas to each new connection.
+    """
+
+    def __init__(self, journal_mode='WAL', synchronous='NORMAL',
+                 mmap_size=0, busy_timeout=5000):
+        self.pragmas = (('journal_mode', journal_mode),
+                        ('synchronous', synchronous),
+                        ('mmap_size', int(mmap_size)),
+                        ('busy_timeout', int(busy_timeout)))
+
+    def connect(self, dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        for name, value in self.pragmas:
+            cursor.execute("PRAGMA %s=%s" % (name, value))
+        cursor.close()
+
+
+class WriterQueue(SessionExtension):
+    """
+    Lets one session of the process write at a time. Sessions queue
+    for a single token before their first write, a flush or a write
+    statement through session.execute(), and hand it back once the
+    transaction is committed, rolled back or closed. If the token
+    does not come back within timeout, the write goes ahead and
+    SQLite's busy timeout takes over.
+    """
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self.enabled = False
+        self.tokens = Queue.Queue(maxsize=1)
+        self.tokens.put(True)
+
+    def acquire(self):
+        try:
+            return self.tokens.get(timeout=self.timeout)
+        except Queue.Empty:
+            return False
+
+    def release(self):
+        self.tokens.put(True)
+
+    def begin_write(self, session):
+        if self.enabled and not getattr(session, '_writer_token', False):
+            session._writer_token = self.acquire()
+
+    def end_write(self, session):
+        if getattr(session, '_writer_token', False):
+            session._writer_token = False
+            self.release()
+
+    def before_flush(self, session, flush_context, instances):
+        self.begin_write(session)
+
+    def after_commit(self, session):
+        self.end_write(session)
+
+    after_rollback = after_commit
+
+
+def is_write(clause):
+    """
+    True for INSERT, UPDATE and DELETE statements and other non-SELECT
+    text.
+    """
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, basestring):
+        return not clause.lstrip().lower().startswith('select')
+    if isinstance(clause, _TextClause):
+        return not clause.text.lstrip().lower().startswith('select')
+    return False
+
+
+def is_file_database(info):
+    return info.drivername == 'sqlite' and info.database not in (None, '', ':memory:')
+
+def engine_options(config):
+    """
+    create_engine() keyword arguments of the profile for a config.
+    """
+    settings = dict(DEFAULTS)
+    settings.update((k, v) for k, v in config.items() if k in DEFAULTS)
+
+    pragmas = SQLitePragmas(journal_mode=settings['SQLITE_JOURNAL_MODE'],
+                            synchronous=settings['SQLITE_SYNCHRONOUS'],
+                            mmap_size=settings['SQLITE_MMAP_SIZE'],
+                            busy_timeout=settings['SQLITE_BUSY_TIMEOUT'])
+
+    return dict(listeners=[pragmas],
+                poolclass=QueuePool,
+                pool_size=settings['SQLITE_POOL_SIZE'],
+                max_overflow=0,
+                connect_args={'check_same_thread': False,
+                              'timeout': settings['SQLITE_BUSY_TIMEOUT'] / 1000.0})
+
+
+writer_queue = WriterQueue()
+
+
+class PrimaryAfterWrite(SessionExtension):
+    """
+    Sends the reads of a request to the primary once it writes, and
+    those of the client for SQLALCHEMY_STICKY_SECONDS.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def written(self, session):
+        ctx = _request_ctx_stack.top
+        if ctx is None or getattr(ctx, 'db_written', False):
+            return
+        ctx.db_written = True
+        ctx.db_replica = False
+        if self.db.get_replicas(ctx.app):
+            seconds = ctx.app.config.get('SQLALCHEMY_STICKY_SECONDS', 10)
+            client_session['db_primary_until'] = int(time.time()) + seconds
+
+    def before_flush(self, session, flush_context, instances):
+        self.written(session)
+
+
+def replica_request():
+    """
+    Returns the request context when the current request may read 
+    from a replica, else None.
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is None or ctx.request.method not in ('GET', 'HEAD'):
+        return None
+
+    endpoint = ctx.request.endpoint
+    patterns = ctx.app.config.get('SQLALCHEMY_READ_ENDPOINTS', READ_ENDPOINTS)
+    if not endpoint or not any(fnmatch(endpoint, p) for p in patterns):
+        return None
+
+    if client_session.get('db_primary_until', 0) > time.time():
+        return None
+
+    return ctx
+
+
+class RoutingSession(_SignallingSession):
+    """
+    Session reading from a replica when replica_request() allows it.
+    Flushes and commits always go to the primary.
+    """
+
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        super(RoutingSession, self).__init__(db, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        # flushes find db_replica set to False by PrimaryAfterWrite
+        ctx = replica_request()
+        if ctx is not None:
+            engine = getattr(ctx, 'db_replica', None)
+            if engine is None:
+                replicas = self.db.get_replicas(ctx.app)
+                # one replica per request, for consistent reads
+                engine = random.choice(replicas) if replicas else False
+                ctx.db_replica = engine
+            if engine:
+                return engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def execute(self, clause, *args, **kwargs):
+        if is_write(clause):
+            self.db.primary_after_write.written(self)
+            writer_queue.begin_write(self)
+        return super(RoutingSession, self).execute(clause, *args, **kwargs)
+
+    def close(self):
+        try:
+            super(RoutingSession, self).close()
+        finally:
+            # a transaction that wrote but never committed or rolled back
+            writer_queue.end_write(self)
+
+
+
+class EngineConnector(_EngineConnector):
+    """
+    Builds the engine like flaskext.sqlalchemy does. In debug mode that
+    puts its query recording proxy in place of the statement counter
+    of apply_driver_hacks; here the counter hands on to it instead.
+    """
+
+    def get_engine(self):
+        with self._lock:
+            uri = self.get_uri()
+            echo = self._app.config['SQLALCHEMY_ECHO']
+            if (uri, echo) == self._connected_for:
+                return self._engine
+            info = make_url(uri)
+            options = {'convert_unicode': True}
+            self._sa.apply_pool_defaults(self._app, options)
+            self._sa.apply_driver_hacks(self._app, info, options)
+            if _record_queries(self._app):
+                proxy = _ConnectionDebugProxy(self._app.import_name)
+                if isinstance(options.get('proxy'), queries.QueryCounter):
+                    options['proxy'].proxy = proxy
+                else:
+                    options['proxy'] = proxy
+            if echo:
+                options['echo'] = True
+            self._engine = rv = sqlalchemy.create_engine(info, **options)
+            self._connected_for = (uri, echo)
+            return rv
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    flaskext.sqlalchemy with the SQLite profile applied to file
+    databases, and reads routed to replicas.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._replicas = {}
+        self._replicas_lock = threading.Lock()
+        self.primary_after_write = PrimaryAfterWrite(self)
+        extensions = list(kwargs.get('session_extensions') or ())
+        kwargs['session_extensions'] = extensions + [self.primary_after_write]
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def create_scoped_session(self, options=None):
+        if options is None:
+            options = {}
+        return orm.scoped_session(partial(RoutingSession, self, **options))
+
+    def make_connector(self, app, bind=None):
+        return EngineConnector(self, app, bind)
+
+    def get_replicas(self, app):
+        """
+        The engines of the app's SQLALCHEMY_REPLICAS, created once.
+        """
+        engines = self._replicas.get(app)
+        if engines is None:
+            with self._replicas_lock:
+                engines = self._replicas.get(app)
+                if engines is None:
+                    engines = []
+                    for uri in app.config.get('SQLALCHEMY_REPLICAS', ()):
+                        info = make_url(uri)
+                        options = {'convert_unicode': True}
+                        self.apply_driver_hacks(app, info, options)
+                        engines.append(sqlalchemy.create_engine(info, **options))
+                    self._replicas[app] = engines
+        return engines
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+        if queries.enabled(app):
+            options['proxy'] = queries.QueryCounter()
+
+        if is_file_database(info) and \
+           app.config.get('SQLITE_TUNING', DEFAULTS['SQLITE_TUNING']):
+            options.pop('pool_size', None)
+            options.update(engine_options(app.config))
+
+            writer_queue.timeout = app.config.get('SQLITE_WRITE_TIMEOUT',
+                                                  DEFAULTS['SQLITE_WRITE_TIMEOUT'])
+            writer_queue.enabled = True
@@ -1,15 +1,30 @@
 #!/usr/bin/env python
 #coding=utf-8
 
-from flaskext.mail import Mail
-from flaskext.sqlalchemy import SQLAlchemy
 from flaskext.cache import Cache
-from flaskext.uploads import UploadSet, IMAGES
 
-__all__ = ['mail', 'db', 'cache', 'photos']
+from pypress.passwords import PasswordHasher
+from pypress.database import SQLAlchemy, writer_queue
+from pypress.lazy import LazyExtension
 
-mail = Mail()
-db = SQLAlchemy()
+__all__ = ['mail', 'db', 'cache', 'photos', 'passwords']
+
+def _mail():
+    from flaskext.mail import Mail
+    return Mail()
+
+def _photos():
+    from flaskext.uploads import UploadSet, IMAGES
+    return UploadSet('photos', IMAGES)
+
+def _configure_photos(photos, app):
+    from flaskext.uploads import configure_uploads
+    configure_uploads(app, (photos,))
+
+# mail and uploads are imported on first use
+mail = LazyExtension(_mail)
+db = SQLAlchemy(session_extensions=[writer_queue])
 cache = Cache()
-photos = UploadSet('photos', IMAGES)
+photos = LazyExtension(_photos, _configure_photos)
+passwords = PasswordHasher()
 
@@ -1 +1 @@
-#!/usr/bin/env pythonfrom .account import LoginForm, SignupForm, RecoverPasswordForm, \            ChangePasswordForm, DeleteAccountForm, TwitterFormfrom .blog import PostForm, CommentForm, LinkForm, TemplateForm
\ No newline at end of file
+#!/usr/bin/env pythonfrom .account import LoginForm, SignupForm, RecoverPasswordForm, \            ChangePasswordForm, DeleteAccountForm, TwitterFormfrom .blog import PostForm, CommentForm, LinkForm, TemplateForm, \            comment_form
\ No newline at end of file
@@ -10,6 +10,8 @@
 from flaskext.wtf import Form, TextAreaField, SubmitField, TextField, \
         ValidationError, required, email, url, optional
 
+from flask import g, current_app
+
 from flaskext.babel import gettext, lazy_gettext as _ 
 
 from pypress.helpers import slugify
@@ -66,6 +68,19 @@ class CommentForm(Form):
     cancel = SubmitField(_("Cancel"))
 
 
+def comment_form(*args, **kwargs):
+    """
+    A CommentForm, with a CSRF token as CSRF_ENABLED says. Anonymous
+    visitors get theirs without one, since the post pages showing it
+    are cached for all of them, and an anonymous comment has no
+    session to protect.
+    """
+    kwargs.setdefault('csrf_enabled',
+                      current_app.config.get('CSRF_ENABLED', True) and
+                      g.user is not None)
+    return CommentForm(*args, **kwargs)
+
+
 class LinkForm(Form):
 
     name = TextField(_("Site name"), validators=[
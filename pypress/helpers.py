@@ -12,18 +12,21 @@ import urlparse
 import functools
 import hashlib
 import socket, struct
+import threading
+import time
 
 from datetime import datetime
+from collections import OrderedDict
 
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
 
-from flask import current_app, g
-from flaskext.babel import gettext, ngettext, format_date, format_datetime
+from flask import current_app, g, request, session
+from babel import dates
+from flaskext.babel import gettext, ngettext, get_locale, to_user_timezone
 from flaskext.themes import render_theme_template 
 
+from pypress import signals
 from pypress.extensions import cache
+from pypress.compress import compress_variants, precompressed_response
 
 class Storage(dict):
     """
@@ -63,6 +66,61 @@ class Storage(dict):
 
 storage = Storage
 
+class LRUCache(object):
+    """
+    A small thread-safe mapping which keeps at most `maxsize` items,
+    evicting the least recently used one. If `timeout` is given, items
+    also expire that many seconds after being set. Shares the get/set 
+    interface of the werkzeug caches so it can stand in for 
+    process-local data.
+    >>> c = LRUCache(maxsize=2)
+    >>> c.set('a', 1); c.set('b', 2); c.set('c', 3)
+    >>> c.get('a') is None
+    True
+    >>> c.get('c')
+    3
+    """
+    def __init__(self, maxsize=128, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.timeout is not None:
+            expires = time.time() + self.timeout
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
 _punct_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
 _pre_re = re.compile(r'<pre (?=l=[\'"]?\w+[\'"]?).*?>(?P<code>[\w\W]+?)</pre>')
 _lang_re = re.compile(r'l=[\'"]?(?P<lang>\w+)[\'"]?')
@@ -80,8 +138,52 @@ markdown = functools.partial(markdown.markdown,
                              safe_mode='remove',
                              output_format="html")
 
-cached = functools.partial(cache.cached,
-                           unless= lambda: g.user is not None)
+# bumped by expire_cached() to drop every page stored by cached()
+CACHED_VERSION_KEY = 'view/version'
+
+def expire_cached(*args, **kwargs):
+    """
+    Expires the pages stored by cached(). Connected to the signals of
+    changes that show on pages.
+    """
+    cache.set(CACHED_VERSION_KEY, int(time.time() * 1000), 
+              timeout=30 * 86400)
+
+for signal in (signals.post_added, signals.post_updated, signals.post_deleted,
+               signals.comment_added, signals.comment_deleted):
+    signal.connect(expire_cached)
+
+def cached(timeout=None, key_prefix='view/%s'):
+    """
+    Caches a view for anonymous users. The body is stored with its
+    compressed variants, so compression happens once per cache fill.
+    Responses carrying flashed messages are not stored.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated(*args, **kwargs):
+            if g.user is not None or session.get('_flashes'):
+                return f(*args, **kwargs)
+
+            # one copy per resolved locale, not per Accept-Language
+            key = "%s@%s/%s" % (key_prefix % request.path, get_locale(),
+                                cache.get(CACHED_VERSION_KEY) or 0)
+            rv = cache.get(key)
+
+            if rv is None:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200 or not response.is_sequence:
+                    return response
+                body = response.data
+                rv = (body, compress_variants(body), response.mimetype,
+                      hashlib.md5(body).hexdigest())
+                cache.set(key, rv, timeout=timeout)
+
+            response = precompressed_response(*rv)
+            response.headers['Vary'] = 'Accept-Encoding, Accept-Language, Cookie'
+            return response
+        return decorated
+    return decorator
 
 def get_theme():
     return current_app.config['THEME']
@@ -100,42 +202,108 @@ def request_wants_json(request):
     return best == 'application/json' and \
        request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
 
+# timesince units, largest first: (unit, translation of n units)
+TIMESINCE_UNITS = (
+    ('year', lambda num: ngettext("%(num)s year", "%(num)s years", num=num)),
+    ('month', lambda num: ngettext("%(num)s month", "%(num)s months", num=num)),
+    ('week', lambda num: ngettext("%(num)s week", "%(num)s weeks", num=num)),
+    ('day', lambda num: ngettext("%(num)s day", "%(num)s days", num=num)),
+    ('hour', lambda num: ngettext("%(num)s hour", "%(num)s hours", num=num)),
+    ('minute', lambda num: ngettext("%(num)s minute", "%(num)s minutes", num=num)),
+    ('second', lambda num: ngettext("%(num)s second", "%(num)s seconds", num=num)),
+)
+
+_timesince_units = dict(TIMESINCE_UNITS)
+
+# translated "n units ago", keyed by (locale, unit, n)
+_timesince_cache = LRUCache(maxsize=4096)
+
+# parsed babel date patterns, keyed by (locale, kind, format)
+_date_patterns = LRUCache(maxsize=256)
+
+def _periods(diff):
+    """
+    Yields (unit, n) for each timesince unit of a timedelta, so that
+    only the units up to the first nonzero one are computed.
+    """
+    days, seconds = diff.days, diff.seconds
+    yield 'year', days / 365
+    yield 'month', days / 30
+    yield 'week', days / 7
+    yield 'day', days
+    yield 'hour', seconds / 3600
+    yield 'minute', seconds / 60
+    yield 'second', seconds
+
 def timesince(dt, default=None):
     """
     Returns string representing "time since" e.g.
     3 days ago, 5 hours ago etc.
     """
     
-    if default is None:
-        default = gettext("just now")
-
     now = datetime.utcnow()
     diff = now - dt
 
-    years = diff.days / 365
-    months = diff.days / 30
-    weeks = diff.days / 7
-    days = diff.days
-    hours = diff.seconds / 3600
-    minutes = diff.seconds / 60
-    seconds = diff.seconds 
-
-    periods = (
-        (years, ngettext("%(num)s year", "%(num)s years", num=years)),
-        (months, ngettext("%(num)s month", "%(num)s months", num=months)),
-        (weeks, ngettext("%(num)s week", "%(num)s weeks", num=weeks)),
-        (days, ngettext("%(num)s day", "%(num)s days", num=days)),
-        (hours, ngettext("%(num)s hour", "%(num)s hours", num=hours)),
-        (minutes, ngettext("%(num)s minute", "%(num)s minutes", num=minutes)),
-        (seconds, ngettext("%(num)s second", "%(num)s seconds", num=seconds)),
-    )
+    for unit, num in _periods(diff):
+        if num:
+            key = (str(get_locale()), unit, num)
+            rv = _timesince_cache.get(key)
+            if rv is None:
+                trans = _timesince_units[unit](num)
+                rv = gettext("%(period)s ago", period=trans)
+                _timesince_cache.set(key, rv)
+            return rv
 
-    for period, trans in periods:
-        if period:
-            return gettext("%(period)s ago", period=trans)
+    if default is None:
+        default = gettext("just now")
 
     return default
 
+def date_pattern(kind, format, locale):
+    """
+    Returns the parsed babel pattern of a format for kind 'date' or 
+    'datetime'. Named formats (short, medium, long, full) are 
+    resolved for the locale. Patterns are cached per (locale, format).
+    """
+    key = (str(locale), kind, format)
+    pattern = _date_patterns.get(key)
+    if pattern is None:
+        if format in ('short', 'medium', 'long', 'full'):
+            date_format = dates.get_date_format(format, locale=locale).pattern
+            if kind == 'datetime':
+                time_format = dates.get_time_format(format, locale=locale).pattern
+                date_format = dates.get_datetime_format(format, locale=locale) \
+                                   .replace('{0}', time_format) \
+                                   .replace('{1}', date_format)
+            format = date_format
+        pattern = dates.parse_pattern(format)
+        _date_patterns.set(key, pattern)
+    return pattern
+
+def format_date(date=None, format='medium', rebase=True):
+    """
+    Formats a date or datetime in the current locale, like 
+    flaskext.babel.format_date with cached patterns.
+    """
+    if date is None:
+        date = datetime.utcnow()
+    if rebase and isinstance(date, datetime):
+        date = to_user_timezone(date)
+    locale = get_locale()
+    return date_pattern('date', format, locale).apply(date, locale)
+
+def format_datetime(value=None, format='medium', rebase=True):
+    """
+    Formats a datetime in the current locale and the user's timezone, 
+    like flaskext.babel.format_datetime with cached patterns.
+    """
+    if value is None:
+        value = datetime.utcnow()
+    if rebase:
+        value = to_user_timezone(value)
+    locale = get_locale()
+    return date_pattern('datetime', format, locale).apply(value, locale)
+
 def domain(url):
     """
     Returns the domain of a URL e.g. http://reddit.com/ > reddit.com
@@ -190,17 +358,19 @@ class Gravatar(object):
     :param default: Default type for unregistred emails
     :param force_default: Build only default avatars
     :param force_lower: Make email.lower() before build link
+    :param maxsize: Number of built links kept in memory
 
     From flask-gravatar http://packages.python.org/Flask-Gravatar/
 
     """
     def __init__(self, size=100, rating='g', default='mm',
-                 force_default=False, force_lower=False):
+                 force_default=False, force_lower=False, maxsize=2000):
 
         self.size = size
         self.rating = rating
         self.default = default
         self.force_default = force_default
+        self.links = LRUCache(maxsize=maxsize)
 
     def __call__(self, email, size=None, rating=None, default=None,
                  force_default=None, force_lower=False):
@@ -225,18 +395,51 @@ class Gravatar(object):
         if force_lower:
             email = email.lower()
 
-        hash = hashlib.md5(email).hexdigest()
+        return self.link(email_hash(email), size, rating, default, 
+                         force_default)
 
-        link = 'http://www.gravatar.com/avatar/{hash}'\
-               '?s={size}&d={default}&r={rating}'.format(**locals())
+    def link(self, hash, size=None, rating=None, default=None, 
+             force_default=None):
 
-        if force_default:
-            link = link + '&f=y'
+        """Build gravatar link from an email hash."""
+
+        if size is None:
+            size = self.size
+
+        if rating is None:
+            rating = self.rating
+
+        if default is None:
+            default = self.default
+
+        if force_default is None:
+            force_default = self.force_default
+
+        key = (hash, size, default, rating, force_default)
+
+        link = self.links.get(key)
+        if link is None:
+            link = 'http://www.gravatar.com/avatar/{hash}'\
+                   '?s={size}&d={default}&r={rating}'.format(**locals())
+
+            if force_default:
+                link = link + '&f=y'
+
+            self.links.set(key, link)
 
         return link
 
 gravatar = Gravatar()
 
+def email_hash(email):
+    """
+    Gravatar hash of an email: md5 of the trimmed, lowercased address.
+    Stored on users and comments when they are written.
+    """
+    if isinstance(email, unicode):
+        email = email.encode('utf-8')
+    return hashlib.md5((email or '').strip().lower()).hexdigest()
+
 def gistcode(content):
     result = list(set(re.findall(r"(<a[^<>]*>\s*(https://gist.github.com/\d+)\s*</a>)", content)))
     for i,link in result:
@@ -261,10 +464,18 @@ def code_highlight(value):
 
     return value
     
+# pygments lexers by language, imported on first highlight
+_lexers = {}
+
 def code2html(code, lang):
-    lexer = get_lexer_by_name(lang, stripall=True)
-    formatter = HtmlFormatter()
-    return highlight(code, lexer, formatter)
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import HtmlFormatter
+
+    lexer = _lexers.get(lang)
+    if lexer is None:
+        lexer = _lexers[lang] = get_lexer_by_name(lang, stripall=True)
+    return highlight(code, lexer, HtmlFormatter())
 
 def ip2long(ip):
     return struct.unpack("!I",socket.inet_aton(ip))[0]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    lazy.py
+    ~~~~~~~~~~~~~
+
+    Stand-ins for modules and extensions that are costly to import
+    and rarely used (twitter, oauth2, mail, uploads), so workers boot
+    without them and load them on first use. `load_all()` imports
+    everything up front, for a preforking master.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import sys
+import threading
+
+_registry = []
+
+
+class LazyModule(object):
+    """
+    Imports the named module on first attribute access.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        _registry.append(self)
+
+    def _load(self):
+        module = sys.modules.get(self._name)
+        if module is None:
+            __import__(self._name)
+            module = sys.modules[self._name]
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return "<lazy module %s>" % self._name
+
+
+class LazyExtension(object):
+    """
+    Creates an extension object with factory on first use. init_app
+    calls made before that are replayed through setup(obj, app),
+    obj.init_app(app) by default.
+    """
+
+    def __init__(self, factory, setup=None):
+        self._factory = factory
+        self._setup = setup or (lambda obj, app: obj.init_app(app))
+        self._obj = None
+        self._apps = []
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def init_app(self, app):
+        with self._lock:
+            if self._obj is None:
+                self._apps.append(app)
+                return
+        self._setup(self._obj, app)
+
+    def _load(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    obj = self._factory()
+                    for app in self._apps:
+                        self._setup(obj, app)
+                    self._obj = obj
+        return self._obj
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return "<lazy extension %s>" % (self._obj or self._factory.__name__)
+
+
+def load(lazy):
+    """
+    Loads a lazy module or extension now and returns the real object.
+    """
+    return lazy._load()
+
+def load_all():
+    """
+    Loads every lazy module and extension now.
+    """
+    for lazy in _registry:
+        lazy._load()
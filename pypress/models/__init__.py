@@ -1 +1 @@
-#!/usr/bin/env pythonfrom .users import User, UserCode, Twitterfrom .blog import Post, Tag, Comment, Link
\ No newline at end of file
+#!/usr/bin/env pythonfrom .users import User, UserCode, Twitterfrom .blog import Post, Tag, Comment, Link, Archive
\ No newline at end of file
@@ -8,21 +8,23 @@
 
 import hashlib, re, random
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from werkzeug import cached_property
 
 from flask import abort, current_app, url_for, Markup
 
+from sqlalchemy.exc import IntegrityError
+
 from flaskext.babel import gettext as _
 from flaskext.sqlalchemy import BaseQuery
 from flaskext.principal import RoleNeed, UserNeed, Permission
 
 from pypress import signals
-from pypress.helpers import storage, slugify, markdown
+from pypress.helpers import storage, slugify, markdown, email_hash
 
-from pypress.extensions import db
-from pypress.permissions import moderator, admin
+from pypress.extensions import db, cache
+from pypress.permissions import moderator, admin, Requirement, can_moderate
 
 from pypress.models.users import User
 
@@ -38,14 +40,11 @@ class PostQuery(BaseQuery):
         """
 
         deferred_cols = ("content", 
-                         "tags",
-                         "author.email",
-                         "author.activation_key",
-                         "author.date_joined",
-                         "author.last_login",
-                         "author.last_request")
+                         "tags")
 
+        # lists show post.author_card instead, see prefetch_author_cards
         options = [db.defer(col) for col in deferred_cols]
+        options.append(db.lazyload("author"))
         return self.options(*options)
     
     def get_by_slug(self, slug):
@@ -72,13 +71,146 @@ class PostQuery(BaseQuery):
         if not year:
             return self
         
-        criteria = []
-        criteria.append(db.extract('year',Post.created_date)==year)
-        if month: criteria.append(db.extract('month',Post.created_date)==month)
-        if day: criteria.append(db.extract('day',Post.created_date)==day)
+        begin, end = date_range(year, month, day)
+
+        return self.filter(db.and_(Post.created_date >= begin,
+                                   Post.created_date < end))
+
+    def days(self, year, month):
+        """
+        Returns (date, number of posts) for each day of the month 
+        having posts, oldest first.
+        """
+        day = db.extract('day', Post.created_date)
+
+        rows = self.archive(year, month, None).group_by(day).order_by(day) \
+                   .values(day, db.func.count(Post.id))
+
+        return [(datetime(year, month, int(d)), num) for d, num in rows]
+
+
+def date_range(year, month=None, day=None):
+    """
+    Returns [begin, end) of a year, month or day, so that archive 
+    queries can use the created_date index. Aborts with 404 for 
+    invalid dates.
+    """
+    try:
+        if day:
+            begin = datetime(year, month, day)
+            end = begin + timedelta(days=1)
+        elif month:
+            begin = datetime(year, month, 1)
+            if month < 12:
+                end = datetime(year, month + 1, 1)
+            else:
+                end = datetime(year + 1, 1, 1)
+        else:
+            begin = datetime(year, 1, 1)
+            end = datetime(year + 1, 1, 1)
+    except (ValueError, OverflowError):
+        abort(404)
+    return begin, end
+
+
+class ArchiveQuery(BaseQuery):
+
+    def months(self):
+        return self.filter(Archive.num_posts > 0) \
+                   .order_by(Archive.year.desc(), Archive.month.desc()).all()
+
+    def rebuild(self):
+        """
+        Recounts the posts of every month from the posts table.
+        """
+        year = db.extract('year', Post.created_date)
+        month = db.extract('month', Post.created_date)
+
+        rows = db.session.query(year, month, db.func.count(Post.id)) \
+                         .group_by(year, month).all()
+
+        self.delete()
+        for y, m, num in rows:
+            db.session.add(Archive(year=int(y), month=int(m), num_posts=num))
+        db.session.commit()
+
+        cache.delete("archives")
         
-        q = reduce(db.and_, criteria)
-        return self.filter(q)
+        return len(rows)
+
+
+class Archive(db.Model):
+    """
+    Number of posts per month, kept up to date as posts are 
+    added and deleted.
+    """
+
+    __tablename__ = "archives"
+
+    query_class = ArchiveQuery
+
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    num_posts = db.Column(db.Integer, default=0, nullable=False)
+
+    def __str__(self):
+        return "%d-%02d" % (self.year, self.month)
+
+    @cached_property
+    def date(self):
+        return datetime(self.year, self.month, 1)
+
+    @cached_property
+    def url(self):
+        return url_for("frontend.index", year=self.year, month=self.month)
+
+    @classmethod
+    def update_count(cls, connection, date, delta):
+        """
+        Adds delta to the month of date, inside the flush of the post.
+        """
+        table = cls.__table__
+        where = db.and_(table.c.year==date.year, table.c.month==date.month)
+        update = table.update().where(where) \
+                      .values(num_posts=table.c.num_posts + delta)
+
+        insert = table.insert().values(year=date.year, month=date.month,
+                                       num_posts=delta)
+
+        result = connection.execute(update)
+
+        if result.rowcount == 0 and delta > 0:
+            if connection.dialect.name == 'sqlite':
+                # the post's insert holds the write lock already, and
+                # pysqlite would commit the transaction at a savepoint
+                connection.execute(insert)
+                return
+
+            # another process may insert the month in the meantime, the
+            # savepoint keeps the post's transaction usable then
+            savepoint = connection.begin_nested()
+            try:
+                connection.execute(insert)
+                savepoint.commit()
+            except IntegrityError:
+                savepoint.rollback()
+                connection.execute(update)
+
+
+class PostMapperExtension(db.MapperExtension):
+    """
+    Keeps the monthly archive counts in step with the posts table.
+    """
+
+    def after_insert(self, mapper, connection, instance):
+        Archive.update_count(connection, 
+                             instance.created_date or datetime.utcnow(), 1)
+        return db.EXT_CONTINUE
+
+    def after_delete(self, mapper, connection, instance):
+        if instance.created_date:
+            Archive.update_count(connection, instance.created_date, -1)
+        return db.EXT_CONTINUE
 
 
 class Post(db.Model):
@@ -99,14 +231,15 @@ class Post(db.Model):
     _slug = db.Column("slug", db.Unicode(50), unique=True, index=True)
     content = db.Column(db.UnicodeText)
     num_comments = db.Column(db.Integer, default=0)
-    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     update_time = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     _tags = db.Column("tags", db.Unicode(100), index=True)
 
     author = db.relation(User, innerjoin=True, lazy="joined")
 
-    __mapper_args__ = {'order_by': id.desc()}
+    __mapper_args__ = {'order_by': id.desc(),
+                       'extension': PostMapperExtension()}
         
     class Permissions(object):
         
@@ -115,11 +248,11 @@ class Post(db.Model):
 
         @cached_property
         def edit(self):
-            return Permission(UserNeed(self.obj.author_id))
+            return Requirement(UserNeed(self.obj.author_id))
   
         @cached_property
         def delete(self):
-            return Permission(UserNeed(self.obj.author_id)) & moderator
+            return Requirement(UserNeed(self.obj.author_id)) & moderator
   
     def __init__(self, *args, **kwargs):
         super(Post, self).__init__(*args, **kwargs)
@@ -163,7 +296,7 @@ class Post(db.Model):
         if self.id:
             # ensure existing tag references are removed
             d = db.delete(post_tags, post_tags.c.post_id==self.id)
-            db.engine.execute(d)
+            db.session.execute(d)
 
         for tag in set(self.taglist):
 
@@ -230,6 +363,10 @@ class Post(db.Model):
 
         return parents
 
+    @cached_property
+    def author_card(self):
+        return User.query.cards([self.author_id])[self.author_id]
+
     @cached_property
     def json(self):
         """
@@ -331,6 +468,19 @@ class Tag(db.Model):
                           Post.id==post_tags.c.post_id)).as_scalar())
 
 
+class CommentMapperExtension(db.MapperExtension):
+    """
+    Stores the email hash of anonymous comments for their avatar.
+    """
+
+    def before_insert(self, mapper, connection, instance):
+        if instance.email:
+            instance.email_hash = email_hash(instance.email)
+        return db.EXT_CONTINUE
+
+    before_update = before_insert
+
+
 class Comment(db.Model):
 
     __tablename__ = "comments"
@@ -350,6 +500,7 @@ class Comment(db.Model):
                           db.ForeignKey("comments.id", ondelete='CASCADE'))
     
     email = db.Column(db.String(50))
+    email_hash = db.Column(db.String(32))
     nickname = db.Column(db.Unicode(50))
     website = db.Column(db.String(100))
 
@@ -364,7 +515,8 @@ class Comment(db.Model):
 
     parent = db.relation('Comment', remote_side=[id])
 
-    __mapper_args__ = {'order_by' : id.asc()}
+    __mapper_args__ = {'order_by' : id.asc(),
+                       'extension': CommentMapperExtension()}
     
     class Permissions(object):
         
@@ -373,12 +525,12 @@ class Comment(db.Model):
         
         @cached_property
         def reply(self):
-            return Permission(UserNeed(self.obj.post.author_id))
+            return Requirement(UserNeed(self.obj.post.author_id))
 
         @cached_property
         def delete(self):
-            return Permission(UserNeed(self.obj.author_id),
-                              UserNeed(self.obj.post.author_id)) & moderator
+            return Requirement(UserNeed(self.obj.author_id),
+                               UserNeed(self.obj.post.author_id)) & moderator
 
     def __init__(self, *args, **kwargs):
         super(Comment, self).__init__(*args, **kwargs)
@@ -391,6 +543,7 @@ class Comment(db.Model):
         if self._author:
             return self._author
         return storage(email = self.email, 
+                       email_hash = self.email_hash or email_hash(self.email),
                        nickname = self.nickname, 
                        website = self.website)
 
@@ -437,11 +590,11 @@ class Link(db.Model):
         
         @cached_property
         def edit(self):
-            return moderator
+            return can_moderate
 
         @cached_property
         def delete(self):
-            return moderator
+            return can_moderate
 
     def __init__(self, *args, **kwargs):
         super(Link, self).__init__(*args, **kwargs)
@@ -453,6 +606,17 @@ class Link(db.Model):
     def __str__(self):
         return self.name
 
+def prefetch_author_cards(posts):
+    """
+    Looks up the author cards of a page of posts at once and 
+    assigns each post's `author_card`.
+    """
+    cards = User.query.cards([post.author_id for post in posts])
+    for post in posts:
+        # fill in the cached_property
+        post.__dict__['author_card'] = cards[post.author_id]
+    return posts
+
 # ------------- SIGNALS ----------------#
 
 def update_num_comments(sender):
@@ -464,3 +628,11 @@ def update_num_comments(sender):
 signals.comment_added.connect(update_num_comments)
 signals.comment_deleted.connect(update_num_comments)
 
+
+def clear_archives(sender):
+    cache.delete("archives")
+
+
+signals.post_added.connect(clear_archives)
+signals.post_deleted.connect(clear_archives)
+
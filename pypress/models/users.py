@@ -6,7 +6,7 @@
     :license: BSD, see LICENSE for more details.
 """
 
-import hashlib
+import threading
 
 from datetime import datetime
 
@@ -14,13 +14,34 @@ from werkzeug import cached_property
 
 from flask import abort, current_app
 
+from sqlalchemy.exc import DBAPIError
+
 from flaskext.sqlalchemy import BaseQuery
 from flaskext.principal import RoleNeed, UserNeed, Permission
 
-from pypress.extensions import db, cache
+from pypress.extensions import db, cache, passwords
+from pypress.passwords import PoolBusy
 from pypress.permissions import admin
+from pypress.helpers import LRUCache, email_hash
+
+from pypress.lazy import LazyModule
+
+twitter = LazyModule('pypress.twitter')
+
+# process-wide twitter.Api clients, keyed by user id. An Api only
+# changes its state through its setters, so threads share it.
+twitter_apis = LRUCache(maxsize=200)
+_twitter_apis_lock = threading.Lock()
+
+# process-wide twitter.RateLimiter instances, keyed by access token:
+# the quotas are the token's, whichever Api instance spends them
+twitter_limiters = LRUCache(maxsize=1000)
+
+# process-wide UserSnapshot instances, keyed by user id
+identity_cache = LRUCache(maxsize=1000, timeout=60)
 
-from pypress import twitter
+# process-wide AuthorCard instances, keyed by user id
+author_cards = LRUCache(maxsize=1000, timeout=300)
 
 class UserQuery(BaseQuery):
 
@@ -29,15 +50,26 @@ class UserQuery(BaseQuery):
         Loads user from flaskext.principal.Identity instance and
         assigns permissions from user.
 
-        A "user" instance is monkeypatched to the identity instance.
+        A read-only UserSnapshot, taken from identity_cache when 
+        possible, is monkeypatched to the identity instance.
 
         If no user found then None is returned.
         """
 
         try:
-            user = self.get(int(identity.name))
-        except ValueError:
-            user = None
+            user_id = int(identity.name)
+        except (TypeError, ValueError):
+            user_id = None
+
+        user = None
+
+        if user_id is not None:
+            user = identity_cache.get(user_id)
+            if user is None:
+                orm_user = self.get(user_id)
+                if orm_user:
+                    user = UserSnapshot(orm_user)
+                    identity_cache.set(user_id, user)
 
         if user:
             identity.provides.update(user.provides)
@@ -45,6 +77,32 @@ class UserQuery(BaseQuery):
         identity.user = user
 
         return user
+
+    def cards(self, ids):
+        """
+        Returns {id: AuthorCard} for the given user ids, from 
+        author_cards when possible and the misses in one query.
+        """
+        cards = {}
+        missing = []
+
+        for user_id in set(ids):
+            card = author_cards.get(user_id)
+            if card is None:
+                missing.append(user_id)
+            else:
+                cards[user_id] = card
+
+        if missing:
+            rows = self.filter(User.id.in_(missing)) \
+                       .values(User.id, User.username, User.nickname, 
+                               User.email, User._email_hash)
+            for row in rows:
+                card = AuthorCard(*row)
+                author_cards.set(card.id, card)
+                cards[card.id] = card
+
+        return cards
     
     def authenticate(self, login, password):
         
@@ -53,6 +111,15 @@ class UserQuery(BaseQuery):
 
         if user:
             authenticated = user.check_password(password)
+            if authenticated and passwords.needs_rehash(user.password):
+                # upgrade md5 and older hashes while we have the password,
+                # or at a later login if the pool is busy
+                try:
+                    user.password = password
+                except PoolBusy:
+                    pass
+                else:
+                    db.session.commit()
         else:
             authenticated = False
 
@@ -71,12 +138,34 @@ class UserQuery(BaseQuery):
         return user
 
 
+class UserMapperExtension(db.MapperExtension):
+    """
+    Keeps the stored email hash current and drops the cached 
+    UserSnapshot and AuthorCard whenever a user row changes.
+    """
+
+    def before_insert(self, mapper, connection, instance):
+        instance.email_hash = email_hash(instance.email)
+        return db.EXT_CONTINUE
+
+    before_update = before_insert
+
+    def after_update(self, mapper, connection, instance):
+        identity_cache.delete(instance.id)
+        author_cards.delete(instance.id)
+        return db.EXT_CONTINUE
+
+    after_delete = after_update
+
+
 class User(db.Model):
 
     __tablename__ = 'users'
     
     query_class = UserQuery
 
+    __mapper_args__ = {'extension': UserMapperExtension()}
+
     PER_PAGE = 50
     TWEET_PER_PAGE = 30
     
@@ -88,7 +177,8 @@ class User(db.Model):
     username = db.Column(db.String(20), unique=True)
     nickname = db.Column(db.String(20))
     email = db.Column(db.String(100), unique=True, nullable=False)
-    _password = db.Column("password", db.String(80), nullable=False)
+    _email_hash = db.Column("email_hash", db.String(32))
+    _password = db.Column("password", db.String(128), nullable=False)
     role = db.Column(db.Integer, default=MEMBER)
     activation_key = db.Column(db.String(40))
     date_joined = db.Column(db.DateTime, default=datetime.utcnow)
@@ -122,16 +212,28 @@ class User(db.Model):
         return self._password
     
     def _set_password(self, password):
-        self._password = hashlib.md5(password).hexdigest()
+        self._password = passwords.hash(password)
     
     password = db.synonym("_password", 
                           descriptor=property(_get_password,
                                               _set_password))
 
+    def _get_email_hash(self):
+        # empty for users stored before the column, until 
+        # manage.py email_hashes runs
+        return self._email_hash or email_hash(self.email)
+
+    def _set_email_hash(self, value):
+        self._email_hash = value
+
+    email_hash = db.synonym("_email_hash",
+                            descriptor=property(_get_email_hash,
+                                                _set_email_hash))
+
     def check_password(self,password):
         if self.password is None:
             return False        
-        return self.password == hashlib.md5(password).hexdigest()
+        return passwords.check(password, self.password)
     
     @cached_property
     def provides(self):
@@ -156,29 +258,45 @@ class User(db.Model):
 
     @cached_property
     def twitter_api(self):
-        if self.twitter and self.twitter.token \
-                        and self.twitter.token_secret:
+        """
+        Returns a twitter.Api client for this user, or None if no 
+        access token. Clients are shared by the threads of a process
+        until the token changes.
+        """
+        tw = self.twitter
+        if not (tw and tw.token and tw.token_secret):
+            return None
+
+        token = (tw.token, tw.token_secret)
+
+        cached = twitter_apis.get(self.id)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+
+        with _twitter_apis_lock:
+            cached = twitter_apis.get(self.id)
+            if cached is not None and cached[0] == token:
+                return cached[1]
+
             api = twitter.Api(current_app.config['TWITTER_KEY'], 
                               current_app.config['TWITTER_SECRET'],
-                              self.twitter.token,
-                              self.twitter.token_secret)
-        else:
-            api = None
+                              tw.token,
+                              tw.token_secret,
+                              lazy_models=True)
+
+            limiter = twitter_limiters.get(token)
+            if limiter is None:
+                limiter = twitter.RateLimiter()
+                twitter_limiters.set(token, limiter)
+            api.SetRateLimiter(limiter)
+
+            twitter_apis.set(self.id, (token, api))
 
         return api
 
     @cached_property
     def tweets(self):
-        api = self.twitter_api
-        if api:
-            info = api.VerifyCredentials()
-            try:
-                tweets = api.GetUserTimeline(screen_name=info.screen_name, count=self.TWEET_PER_PAGE)
-            except:
-                return []
-        else:
-            return []
-        return tweets
+        return prefetch_tweets([self])[0]
 
     def post_twitter(self, content):
         
@@ -191,6 +309,118 @@ class User(db.Model):
         return True
 
 
+class UserSnapshot(object):
+    """
+    Immutable copy of the identity columns of a User, shared across
+    requests by identity_cache.
+
+    Any other attribute is looked up on the User loaded in the current
+    session, so the row is only fetched when a view needs more than the
+    identity (twitter tokens, relations, or to change the user). Once
+    the user is deleted those attributes are None.
+    """
+
+    __slots__ = ('id', 'username', 'nickname', 'email', 'role', 'provides')
+
+    def __init__(self, user):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(user, name))
+        object.__setattr__(self, 'provides', tuple(user.provides))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only, use load()")
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        user = self.load()
+        if user is None:
+            return None
+        return getattr(user, name)
+
+    def __eq__(self, other):
+        return isinstance(other, (User, UserSnapshot)) and other.id == self.id
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.nickname
+    
+    def __repr__(self):
+        return "<%s>" % self
+
+    is_moderator = User.is_moderator
+    is_admin = User.is_admin
+
+    MODERATOR = User.MODERATOR
+    ADMIN = User.ADMIN
+
+    def load(self):
+        """
+        Returns the User this snapshot was taken from, from the 
+        current session, or None if it has been deleted since.
+        """
+        user = User.query.get(self.id)
+        if user is None:
+            identity_cache.delete(self.id)
+        return user
+
+
+class AuthorCard(object):
+    """
+    What post lists show of an author: names and the email hash.
+    Shared across posts and requests by author_cards.
+    """
+
+    __slots__ = ('id', 'username', 'nickname', 'email_hash')
+
+    def __init__(self, id, username, nickname, email, hash=None):
+        self.id = id
+        self.username = username
+        self.nickname = nickname
+        self.email_hash = hash or email_hash(email)
+
+    def __str__(self):
+        return self.nickname
+    
+    def __repr__(self):
+        return "<%s>" % self
+
+
+def prefetch_tweets(users):
+    """
+    Fetches the timelines of several users concurrently and assigns
+    each user's `tweets`. Returns the timelines in the order of users.
+    """
+    calls = []
+    for user in users:
+        api = user.twitter_api
+        try:
+            screen_name = api and user.twitter.verify_screen_name(api)
+        except:
+            screen_name = None
+        if screen_name:
+            calls.append((api.GetUserTimeline, (), 
+                          dict(screen_name=screen_name, 
+                               count=User.TWEET_PER_PAGE)))
+        else:
+            calls.append(list)
+
+    timelines = twitter.Batch(calls, return_exceptions=True)
+
+    for i, user in enumerate(users):
+        if isinstance(timelines[i], Exception):
+            timelines[i] = []
+        # fill in the cached_property
+        user.__dict__['tweets'] = timelines[i]
+
+    return timelines
+
+
 class UserCode(db.Model):
 
     __tablename__ = 'usercode'
@@ -222,10 +452,44 @@ class Twitter(db.Model):
     
     token = db.Column(db.String(50))
     token_secret = db.Column(db.String(50))
+    screen_name = db.Column(db.String(20))
     
     def __init__(self, *args, **kwargs):
         super(Twitter, self).__init__(*args, **kwargs)
 
+    def verify_screen_name(self, api):
+        """
+        Returns the screen name of the token owner. Tokens stored 
+        without one ask VerifyCredentials once, and the answer is 
+        written on its own connection: this runs while pages render, 
+        so the session of the request is left alone.
+        """
+        if self.screen_name is None:
+            info = api.VerifyCredentials()
+            if info is None:
+                return None
+            table = self.__table__
+            try:
+                db.engine.execute(table.update()
+                                  .where(table.c.id==self.id)
+                                  .where(table.c.screen_name==None)
+                                  .values(screen_name=info.screen_name))
+            except DBAPIError:
+                # asked again on a later page view
+                current_app.logger.exception("storing the screen name "
+                                             "of %s failed" % self.user_id)
+            return info.screen_name
+        return self.screen_name
+
+    def refresh_screen_name(self, api):
+        """
+        Stores the screen name of the token owner. The caller commits.
+        """
+        info = api.VerifyCredentials()
+        if info is not None:
+            self.screen_name = info.screen_name
+        return self.screen_name
+
     def __str__(self):
         return self.user_id
     
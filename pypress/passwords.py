@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    passwords.py
+    ~~~~~~~~~~~~~
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import hmac
+import base64
+import hashlib
+import binascii
+import threading
+import Queue
+
+class PoolBusy(Exception):
+    """
+    Raised when the hashing queue is full or a job did not finish in
+    time, e.g. during a login flood.
+    """
+
+
+class _Job(object):
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # set when the caller stopped waiting, the job is then skipped
+        self.abandoned = False
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception, e:
+            self.error = e
+        self.done.set()
+
+
+class WorkerPool(object):
+    """
+    A fixed number of threads running CPU heavy jobs from a bounded
+    queue. A caller finding the queue full fails at once, and one
+    waiting longer than timeout gives up its job, so a burst of logins
+    can't occupy every thread serving pages. Threads are started on
+    first use in each process.
+    """
+
+    def __init__(self, workers=2, queue_size=64, timeout=10):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._pid = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue.Queue(self.queue_size)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, args=(self._queue,))
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self, queue):
+        while True:
+            job = queue.get()
+            if not job.abandoned:
+                job.run()
+
+    def run(self, func, *args):
+        if self._pid != os.getpid():
+            self._start()
+
+        job = _Job(func, args)
+        try:
+            self._queue.put_nowait(job)
+        except Queue.Full:
+            raise PoolBusy("hashing queue is full")
+
+        if not job.done.wait(self.timeout):
+            job.abandoned = True
+            raise PoolBusy("hashing took more than %s seconds" % self.timeout)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+
+def _to_bytes(password):
+    if isinstance(password, unicode):
+        return password.encode('utf8')
+    return password
+
+def _pbkdf2(password, salt, iterations):
+    digest = hashlib.pbkdf2_hmac('sha256', _to_bytes(password), salt, iterations)
+    return base64.b64encode(digest).rstrip('=')
+
+def _md5(password):
+    return hashlib.md5(_to_bytes(password)).hexdigest()
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks user passwords.
+
+    Hashes are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>".
+    Older unsalted md5 hex digests are still accepted by check() and
+    reported by needs_rehash(), so they are upgraded on the next 
+    successful login.
+
+    Configuration:
+    PASSWORD_ITERATIONS: PBKDF2 cost for new hashes
+    PASSWORD_WORKERS: threads hashing at most at the same time
+    PASSWORD_QUEUE_SIZE: logins allowed to wait for a thread
+    PASSWORD_TIMEOUT: seconds a login waits before PoolBusy is raised
+    """
+
+    ALGORITHM = 'pbkdf2_sha256'
+    DEFAULT_ITERATIONS = 50000
+
+    def __init__(self, app=None):
+        self.iterations = self.DEFAULT_ITERATIONS
+        self.pool = WorkerPool()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.iterations = app.config.get('PASSWORD_ITERATIONS', 
+                                         self.DEFAULT_ITERATIONS)
+        self.pool.workers = app.config.get('PASSWORD_WORKERS', 2)
+        self.pool.queue_size = app.config.get('PASSWORD_QUEUE_SIZE', 64)
+        self.pool.timeout = app.config.get('PASSWORD_TIMEOUT', 10)
+
+    def hash(self, password, iterations=None):
+        if iterations is None:
+            iterations = self.iterations
+        salt = binascii.hexlify(os.urandom(8))
+        digest = self.pool.run(_pbkdf2, password, salt, iterations)
+        return '%s$%d$%s$%s' % (self.ALGORITHM, iterations, salt, digest)
+
+    def check(self, password, encoded):
+        if not encoded:
+            return False
+
+        if '$' not in encoded:
+            return hmac.compare_digest(_md5(password), str(encoded))
+
+        try:
+            algorithm, iterations, salt, digest = encoded.split('$', 3)
+            iterations = int(iterations)
+        except ValueError:
+            return False
+
+        if algorithm != self.ALGORITHM:
+            return False
+
+        return hmac.compare_digest(
+            self.pool.run(_pbkdf2, password, str(salt), iterations), 
+            str(digest))
+
+    def needs_rehash(self, encoded):
+        if not encoded or '$' not in encoded:
+            return True
+        algorithm, iterations = encoded.split('$', 2)[:2]
+        return algorithm != self.ALGORITHM or iterations != str(self.iterations)
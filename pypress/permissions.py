@@ -1,6 +1,8 @@
 #! /usr/bin/env python
 #coding=utf-8
-from flaskext.principal import RoleNeed, Permission
+from flask import g, abort
+
+from flaskext.principal import RoleNeed, Permission, PermissionDenied
 
 admin = Permission(RoleNeed('admin'))
 moderator = Permission(RoleNeed('moderator'))
@@ -9,3 +11,66 @@ auth = Permission(RoleNeed('authenticated'))
 # this is assigned when you want to block a permission to all
 # never assign this role to anyone !
 null = Permission(RoleNeed('null'))
+
+
+class Evaluator(object):
+    """
+    Answers permission checks for one identity. The needs it provides
+    are frozen once, and each answer is cached by need set, so repeated 
+    checks (e.g. one per comment) are a dictionary lookup.
+    """
+
+    def __init__(self, identity):
+        self.identity = identity
+        self.provides = frozenset(getattr(identity, 'provides', ()))
+        self._results = {}
+
+    def allows(self, needs):
+        try:
+            return self._results[needs]
+        except KeyError:
+            result = not needs or not self.provides.isdisjoint(needs)
+            self._results[needs] = result
+            return result
+
+
+def get_evaluator():
+    """
+    Returns the Evaluator of the current request's identity.
+    """
+    identity = getattr(g, 'identity', None)
+    evaluator = getattr(g, '_permission_evaluator', None)
+    if evaluator is None or evaluator.identity is not identity:
+        evaluator = g._permission_evaluator = Evaluator(identity)
+    return evaluator
+
+
+class Requirement(object):
+    """
+    Lightweight stand-in for a Permission used by model permissions:
+    allowed if the identity provides any of the needs. Truth testing
+    goes through the request's Evaluator, and test() behaves like 
+    Permission.test().
+    """
+
+    __slots__ = ('needs',)
+
+    def __init__(self, *needs):
+        self.needs = frozenset(needs)
+
+    def __and__(self, other):
+        return Requirement(*(self.needs | other.needs))
+
+    def can(self):
+        return get_evaluator().allows(self.needs)
+
+    __nonzero__ = can
+
+    def test(self, http_exception=None):
+        if not self.can():
+            if http_exception is not None:
+                abort(http_exception)
+            raise PermissionDenied(self)
+
+
+can_moderate = Requirement(RoleNeed('moderator'))
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    prefork.py
+    ~~~~~~~~~~~~~
+
+    A preforking, threaded server for `manage.py serve` and prefork.py.
+
+    The master binds the socket and forks SERVER_WORKERS processes,
+    each answering with SERVER_THREADS threads. With SERVER_PRELOAD
+    the master first builds the app, imports the lazily loaded modules
+    and serves one warm-up request (or warms the whole cache with
+    WARM_ON_BOOT, see warm.py), so every worker starts with the
+    imports, templates and caches of the master in pages shared with
+    it. Without it each worker builds its own app, reading the config
+    again.
+
+    A worker exits after about SERVER_MAX_REQUESTS requests, which
+    bounds its memory growth, and the master starts a new one. A
+    connection idle for SERVER_TIMEOUT seconds is dropped.
+
+    Signals to the master:
+
+        TERM, INT   stop; workers finish their requests first, for at
+                    most SERVER_GRACEFUL_TIMEOUT seconds
+        HUP         graceful restart; new workers are started and the
+                    old ones finish their requests and exit
+
+    A restart reads the config again: with SERVER_PRELOAD the master
+    builds and preloads a new app before it starts the new workers,
+    and keeps the old one if that fails. It does not load changed
+    code, which the master imported once, nor changed SERVER_*
+    settings; stop and start the server for those.
+
+    Database connections are closed before forking; each worker opens
+    its own.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import gc
+import sys
+import time
+import errno
+import signal
+import random
+import threading
+import traceback
+
+from functools import partial
+
+from werkzeug.serving import BaseWSGIServer
+
+from flask import Config
+
+from pypress import create_app, lazy, warm
+from pypress.extensions import db
+
+DEFAULTS = {
+    'SERVER_WORKERS': 4,
+    'SERVER_THREADS': 4,
+    'SERVER_MAX_REQUESTS': 5000,
+    'SERVER_MAX_REQUESTS_JITTER': 500,
+    'SERVER_TIMEOUT': 30,
+    'SERVER_GRACEFUL_TIMEOUT': 30,
+    'SERVER_PRELOAD': True,
+}
+
+
+def settings(config, **options):
+    """
+    The server settings of a config, overridden by the options given.
+    """
+    rv = dict(DEFAULTS)
+    rv.update((k, v) for k, v in config.items() if k in DEFAULTS)
+    rv.update(('SERVER_' + k.upper(), v) for k, v in options.items()
+              if v is not None)
+    return rv
+
+
+def preload(app, warm_url='/'):
+    """
+    Loads what a worker would load on its first requests.
+    """
+    lazy.load_all()
+    if app.config.get('WARM_ON_BOOT'):
+        # workers inherit the filled cache
+        warm.run(app)
+    elif warm_url:
+        app.test_client().get(warm_url)
+
+    # connections must not be shared between processes
+    with app.test_request_context():
+        db.session.remove()
+        for engine in [db.engine] + db.get_replicas(app):
+            engine.dispose()
+    gc.collect()
+
+
+class WorkerServer(BaseWSGIServer):
+    """
+    The listening socket, shared by the threads of a worker. Threads
+    poll it with a timeout, so they notice when the worker stops.
+    """
+
+    # seconds between checks of the stop flag
+    timeout = 0.5
+
+    def __init__(self, host, port, app, request_timeout=30):
+        BaseWSGIServer.__init__(self, host, port, app)
+        # the threads wake up together, the ones losing the
+        # connection go back to waiting instead of blocking in accept
+        self.socket.setblocking(0)
+        self.request_timeout = request_timeout
+        self.handled = 0
+        self.lock = threading.Lock()
+
+    def get_request(self):
+        conn, address = self.socket.accept()
+        conn.setblocking(1)
+        conn.settimeout(self.request_timeout)
+        return conn, address
+
+    def finish_request(self, request, client_address):
+        try:
+            BaseWSGIServer.finish_request(self, request, client_address)
+        finally:
+            with self.lock:
+                self.handled += 1
+
+
+class Worker(object):
+    """
+    Serves requests with threads until it is stopped or has handled
+    max_requests.
+    """
+
+    def __init__(self, server, threads=4, max_requests=0):
+        self.server = server
+        self.threads = threads
+        self.max_requests = max_requests
+        self.stopping = False
+
+    def install_signals(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    def run(self):
+        threads = [threading.Thread(target=self.serve)
+                   for i in range(max(1, self.threads))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # join() with a timeout, so the stop signal gets through
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+    def serve(self):
+        server = self.server
+        while not self.stopping:
+            if self.max_requests and server.handled >= self.max_requests:
+                break
+            server.handle_request()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+
+class Master(object):
+    """
+    Forks workers serving on host:port and replaces the ones that exit.
+    factory builds the app; with preload it is called once, in the
+    master, else once in each worker.
+    """
+
+    def __init__(self, factory, host='127.0.0.1', port=8080, workers=4,
+                 threads=4, max_requests=5000, max_requests_jitter=500,
+                 timeout=30, graceful_timeout=30, preload=True,
+                 warm_url='/'):
+        self.factory = factory
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.timeout = timeout
+        self.graceful_timeout = graceful_timeout
+        self.preload = preload
+        self.warm_url = warm_url
+
+        self.app = None
+        self.children = set()
+        # workers finishing their requests after a restart
+        self.retiring = set()
+        self.stopping = False
+        self.restarting = False
+
+    def run(self):
+        if self.preload:
+            self.app = self.factory()
+            preload(self.app, self.warm_url)
+
+        self.server = WorkerServer(self.host, self.port, self.app,
+                                   request_timeout=self.timeout)
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.restart)
+
+        self.log("master %d serving on %s:%d with %d workers of %d threads" %
+                 (os.getpid(), self.host, self.port, self.workers, self.threads))
+        try:
+            while not self.stopping:
+                if self.restarting:
+                    self.restarting = False
+                    self.log("restarting workers")
+                    if self.preload:
+                        self.reload()
+                    self.retire(self.children)
+                while len(self.children) < self.workers:
+                    self.spawn()
+                try:
+                    pid, status = os.wait()
+                except OSError, e:
+                    if e.errno not in (errno.EINTR, errno.ECHILD):
+                        raise
+                    continue
+                self.children.discard(pid)
+                self.retiring.discard(pid)
+        finally:
+            self.retire(self.children)
+            self.reap(self.graceful_timeout)
+            self.server.server_close()
+
+    def log(self, message):
+        print >> sys.stderr, "[prefork] %s" % message
+
+    def spawn(self):
+        # workers do not all recycle at the same moment
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return pid
+
+        status = 0
+        try:
+            random.seed()
+            worker = Worker(self.server, self.threads, max_requests)
+            # a TERM while the app is built stops the worker too
+            worker.install_signals()
+            if self.server.app is None:
+                self.server.app = self.factory()
+            worker.run()
+        except:
+            status = 1
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    def reload(self):
+        """
+        Builds and preloads a new app for the workers started next.
+        """
+        try:
+            app = self.factory()
+            preload(app, self.warm_url)
+        except Exception:
+            self.log("building the app failed, keeping the old one")
+            traceback.print_exc()
+            return
+        self.app = self.server.app = app
+
+    def retire(self, pids):
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+                self.retiring.add(pid)
+            except OSError:
+                pass
+            pids.discard(pid)
+
+    def reap(self, timeout):
+        """
+        Waits up to timeout seconds for retiring workers, then kills
+        the ones left.
+        """
+        deadline = time.time() + timeout
+        while self.retiring and time.time() < deadline:
+            for pid in list(self.retiring):
+                try:
+                    done, status = os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    done = pid
+                if done:
+                    self.retiring.discard(pid)
+            time.sleep(0.1)
+        for pid in self.retiring:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.retiring.clear()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def restart(self, signum, frame):
+        self.restarting = True
+
+
+def serve(config='config.cfg', host='127.0.0.1', port=8080, **options):
+    """
+    Runs a Master for create_app(config) with the SERVER_* settings of
+    the config, overridden by options (workers, threads, max_requests,
+    max_requests_jitter, timeout, graceful_timeout, preload).
+    """
+    # read like create_app does, without building an app in the master
+    values = Config(os.path.dirname(os.path.abspath(__file__)))
+    values.from_pyfile(config)
+    s = settings(values, **options)
+
+    Master(partial(create_app, config), host, port,
+           workers=s['SERVER_WORKERS'],
+           threads=s['SERVER_THREADS'],
+           max_requests=s['SERVER_MAX_REQUESTS'],
+           max_requests_jitter=s['SERVER_MAX_REQUESTS_JITTER'],
+           timeout=s['SERVER_TIMEOUT'],
+           graceful_timeout=s['SERVER_GRACEFUL_TIMEOUT'],
+           preload=s['SERVER_PRELOAD']).run()
+
+
+def main(argv=None):
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [-c CONFIG] [-H HOST] [-p PORT] "
+                                "[-w WORKERS] [-t THREADS]")
+    parser.add_option('-c', '--config', dest='config', default='config.cfg')
+    parser.add_option('-H', '--host', dest='host', default='127.0.0.1')
+    parser.add_option('-p', '--port', dest='port', type='int', default=8080)
+    parser.add_option('-w', '--workers', dest='workers', type='int')
+    parser.add_option('-t', '--threads', dest='threads', type='int')
+    parser.add_option('--max-requests', dest='max_requests', type='int')
+    parser.add_option('--timeout', dest='timeout', type='int')
+    parser.add_option('--preload', dest='preload', action='store_true')
+    parser.add_option('--no-preload', dest='preload', action='store_false')
+    options, args = parser.parse_args(argv)
+
+    serve(options.config, options.host, options.port,
+          workers=options.workers,
+          threads=options.threads,
+          max_requests=options.max_requests,
+          timeout=options.timeout,
+          preload=options.preload)
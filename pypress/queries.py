@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    queries.py
+    ~~~~~~~~~~~~~
+
+    Statement counting on the engine. Each request gets a QueryLog
+    when SQLALCHEMY_COUNT_QUERIES is on (default: in debug and testing).
+    A request with more than SQLALCHEMY_QUERY_WARNING statements, or
+    one running the same statement SQLALCHEMY_NPLUSONE_THRESHOLD
+    times with different parameters (an N+1), is logged with the
+    call sites in pypress that issued the statements.
+
+    Tests can bound the statements of a block:
+
+        with max_queries(5):
+            client.get('/')
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import time
+import threading
+import traceback
+
+from contextlib import contextmanager
+from functools import partial
+
+from sqlalchemy.interfaces import ConnectionProxy
+
+from flask import request
+
+_root = os.path.dirname(os.path.abspath(__file__))
+_skip = (os.path.join(_root, 'queries.py'), os.path.join(_root, 'database.py'))
+
+_state = threading.local()
+
+
+class TooManyQueries(AssertionError):
+    pass
+
+
+def call_site():
+    """
+    The innermost frame of pypress code or templates outside this
+    layer, as "file:line in function".
+    """
+    for filename, lineno, function, text in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(filename)
+        if filename.startswith(_root) and not filename.startswith(_skip):
+            return "%s:%d in %s" % (os.path.relpath(filename, _root),
+                                    lineno, function)
+    return "?"
+
+
+class QueryLog(object):
+    """
+    Statements run while the log is active. Statements already seen
+    record the call site, which is what N+1 reports show.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+
+    def record(self, statement, parameters, duration):
+        self.count += 1
+        self.duration += duration
+        seen = self.statements.get(statement)
+        if seen is None:
+            self.statements[statement] = [(parameters, None)]
+        else:
+            seen.append((parameters, call_site()))
+
+    def repeated(self, threshold=3):
+        """
+        Returns [(statement, times, call sites)] for statements run at
+        least threshold times with different parameters, most first.
+        """
+        rv = []
+        for statement, runs in self.statements.items():
+            if len(runs) < threshold:
+                continue
+            if len(set(repr(p) for p, site in runs)) < 2:
+                continue
+            sites = sorted(set(site for p, site in runs if site))
+            rv.append((statement, len(runs), sites))
+        rv.sort(key=lambda r: -r[1])
+        return rv
+
+    def summary(self, threshold=3):
+        lines = ["%d queries in %.1f ms" % (self.count, self.duration * 1000)]
+        for statement, times, sites in self.repeated(threshold):
+            lines.append("N+1: %dx %s" % (times, " ".join(statement.split())))
+            for site in sites:
+                lines.append("    at %s" % site)
+        return "\n".join(lines)
+
+
+def active_logs():
+    logs = getattr(_state, 'logs', None)
+    if logs is None:
+        logs = _state.logs = []
+    return logs
+
+@contextmanager
+def collect():
+    """
+    Yields a QueryLog of the statements run by this thread in the block.
+    """
+    log = QueryLog()
+    logs = active_logs()
+    logs.append(log)
+    try:
+        yield log
+    finally:
+        logs.remove(log)
+
+@contextmanager
+def max_queries(n):
+    """
+    Raises TooManyQueries when the block runs more than n statements.
+    """
+    with collect() as log:
+        yield log
+    if log.count > n:
+        raise TooManyQueries("expected at most %d queries, got %s" %
+                             (n, log.summary(threshold=2)))
+
+
+class QueryCounter(ConnectionProxy):
+    """
+    Engine proxy feeding every statement to the active logs, then
+    handing it on to proxy, if given.
+    """
+
+    def __init__(self, proxy=None):
+        self.proxy = proxy
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        if self.proxy is not None:
+            execute = partial(self.proxy.cursor_execute, execute,
+                              executemany=executemany)
+        logs = getattr(_state, 'logs', None)
+        if not logs:
+            return execute(cursor, statement, parameters, context)
+        start = time.time()
+        try:
+            return execute(cursor, statement, parameters, context)
+        finally:
+            duration = time.time() - start
+            for log in logs:
+                log.record(statement, parameters, duration)
+
+
+def enabled(app):
+    rv = app.config.get('SQLALCHEMY_COUNT_QUERIES')
+    if rv is None:
+        rv = app.debug or app.testing
+    return rv
+
+def init_app(app):
+    """
+    Opens a QueryLog per request and reports heavy requests and N+1s.
+    """
+    if not enabled(app):
+        return
+
+    warning = app.config.get('SQLALCHEMY_QUERY_WARNING', 30)
+    threshold = app.config.get('SQLALCHEMY_NPLUSONE_THRESHOLD', 3)
+
+    @app.before_request
+    def open_query_log():
+        logs = active_logs()
+        # left behind by a request that failed before after_request
+        stale = getattr(_state, 'request_log', None)
+        if stale in logs:
+            logs.remove(stale)
+        log = _state.request_log = request.query_log = QueryLog()
+        logs.append(log)
+
+    @app.after_request
+    def close_query_log(response):
+        log = getattr(request, 'query_log', None)
+        if log is None:
+            return response
+        logs = active_logs()
+        if log in logs:
+            logs.remove(log)
+        response.headers['X-Query-Count'] = str(log.count)
+        if log.count > warning or log.repeated(threshold):
+            app.logger.warning("%s %s: %s" % (request.method, request.path,
+                                              log.summary(threshold)))
+        return response
@@ -8,3 +8,7 @@ signals = Namespace()
 comment_added = signals.signal("comment-added")
 comment_deleted = signals.signal("comment-deleted")
 
+
+post_added = signals.signal("post-added")
+post_updated = signals.signal("post-updated")
+post_deleted = signals.signal("post-deleted")
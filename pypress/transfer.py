@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    transfer.py
+    ~~~~~~~~~~~~~
+
+    Bulk export and import of users, links, posts and comments as
+    JSON lines, one object per line with a "type" key, for
+    `manage.py export` and `manage.py import`.
+
+    Posts whose author is not in the database or the dump are skipped
+    and reported, with their comments.
+
+    Import writes through the tables rather than the models: rows are
+    inserted in batches with one commit per chunk, tags of a chunk are
+    resolved with one query, and the counts kept by signals and mapper
+    extensions (comments per post, the monthly archive) are rebuilt
+    once at the end. Posts given as "markdown" are rendered in a
+    process pool.
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import sys
+import json
+import multiprocessing
+
+from datetime import datetime
+
+from pypress.extensions import db, cache
+from pypress.helpers import slugify, email_hash, markdown
+from pypress.models import User, Post, Comment, Tag, Link, Archive
+from pypress.models.blog import post_tags
+
+# records are written and must be read in this order
+TYPES = ('user', 'link', 'post', 'comment')
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT) if value else None
+
+def parse_date(value):
+    if not value:
+        return datetime.utcnow()
+    return datetime.strptime(value[:19], DATE_FORMAT)
+
+def render_markdown(text):
+    return markdown(text)
+
+
+# ------------- EXPORT ----------------#
+
+def _rows(table, chunk):
+    """
+    Streams the rows of a table in id order, chunk rows per query.
+    """
+    last = 0
+    while True:
+        rows = db.session.execute(db.select([table]) \
+                                    .where(table.c.id > last) \
+                                    .order_by(table.c.id).limit(chunk)) \
+                         .fetchall()
+        if not rows:
+            break
+        for row in rows:
+            yield row
+        last = rows[-1].id
+
+def export(stream, chunk=1000):
+    """
+    Writes every user, link, post and comment to stream as JSON lines.
+    Returns the number of records of each type.
+    """
+    users = User.__table__
+    posts = Post.__table__
+    comments = Comment.__table__
+    links = Link.__table__
+
+    counts = dict((t, 0) for t in TYPES)
+
+    def write(record):
+        stream.write(json.dumps(record) + "\n")
+        counts[record['type']] += 1
+
+    usernames = {}
+    for row in _rows(users, chunk):
+        usernames[row.id] = row.username
+        write(dict(type='user',
+                   username=row.username,
+                   nickname=row.nickname,
+                   email=row.email,
+                   password=row.password,
+                   role=row.role,
+                   date_joined=format_date(row.date_joined)))
+
+    for row in _rows(links, chunk):
+        write(dict(type='link',
+                   name=row.name,
+                   link=row.link,
+                   logo=row.logo,
+                   description=row.description,
+                   email=row.email,
+                   passed=row.passed,
+                   created_date=format_date(row.created_date)))
+
+    for row in _rows(posts, chunk):
+        write(dict(type='post',
+                   id=row.id,
+                   author=usernames.get(row.author_id),
+                   title=row.title,
+                   slug=row.slug,
+                   content=row.content,
+                   tags=row.tags,
+                   created_date=format_date(row.created_date),
+                   update_time=format_date(row.update_time)))
+
+    for row in _rows(comments, chunk):
+        write(dict(type='comment',
+                   id=row.id,
+                   post=row.post_id,
+                   parent=row.parent_id,
+                   author=usernames.get(row.author_id),
+                   email=row.email,
+                   nickname=row.nickname,
+                   website=row.website,
+                   comment=row.comment,
+                   ip=row.ip,
+                   created_date=format_date(row.created_date)))
+
+    return counts
+
+
+# ------------- IMPORT ----------------#
+
+class Importer(object):
+    """
+    Loads JSON lines records into the database in chunks. Post and
+    comment ids are kept, so import into a blog without posts.
+
+    :param chunk: records inserted and committed at a time
+    :param workers: processes rendering markdown posts, 0 for inline
+    """
+
+    def __init__(self, chunk=1000, workers=None):
+        self.chunk = chunk
+        self.workers = multiprocessing.cpu_count() if workers is None else workers
+        self.pool = None
+
+        self.counts = dict((t, 0) for t in TYPES)
+        self.skipped = dict((t, 0) for t in TYPES)
+        self.buffers = dict((t, []) for t in TYPES)
+
+        # ids of skipped posts and comments, whose comments are skipped too
+        self.skipped_ids = dict(post=set(), comment=set())
+
+        self.user_ids = dict(db.session.query(User.username, User.id).all())
+        self.tag_ids = dict(db.session.query(Tag.slug, Tag.id).all())
+        self.slugs = set(slug for slug, in db.session.query(Post.slug).all())
+
+    def load(self, stream):
+        """
+        Reads records from stream and inserts them. Returns the number
+        of records of each type.
+        """
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers)
+        try:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                self.add(record)
+            for type in TYPES:
+                self.flush(type)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+
+        self.finish()
+        return self.counts
+
+    def add(self, record):
+        type = record['type']
+        # earlier types are complete once a later one shows up
+        for other in TYPES[:TYPES.index(type)]:
+            self.flush(other)
+        self.buffers[type].append(record)
+        if len(self.buffers[type]) >= self.chunk:
+            self.flush(type)
+
+    def flush(self, type):
+        records = self.buffers[type]
+        if not records:
+            return
+        inserted = getattr(self, 'insert_%ss' % type)(records)
+        db.session.commit()
+        self.counts[type] += inserted
+        self.buffers[type] = []
+
+    def skip(self, type, record, reason):
+        self.skipped[type] += 1
+        if type in self.skipped_ids:
+            self.skipped_ids[type].add(record['id'])
+        print >> sys.stderr, "skipped %s %s: %s" % (type, record.get('id', ''), 
+                                                    reason)
+
+    def insert_users(self, records):
+        rows = []
+        for r in records:
+            if r['username'] in self.user_ids:
+                continue
+            rows.append(dict(username=r['username'],
+                             nickname=r.get('nickname') or r['username'],
+                             email=r['email'],
+                             email_hash=email_hash(r['email']),
+                             password=r['password'],
+                             role=r.get('role', User.MEMBER),
+                             date_joined=parse_date(r.get('date_joined'))))
+        if rows:
+            db.session.execute(User.__table__.insert(), rows)
+            names = [row['username'] for row in rows]
+            self.user_ids.update(db.session.query(User.username, User.id) \
+                                   .filter(User.username.in_(names)).all())
+        return len(rows)
+
+    def insert_links(self, records):
+        db.session.execute(Link.__table__.insert(),
+                           [dict(name=r['name'],
+                                 link=r['link'],
+                                 logo=r.get('logo'),
+                                 description=r.get('description'),
+                                 email=r.get('email'),
+                                 passed=r.get('passed', False),
+                                 created_date=parse_date(r.get('created_date')))
+                            for r in records])
+        return len(records)
+
+    def render(self, records):
+        """
+        Fills in content from markdown for the records that have it.
+        """
+        todo = [r for r in records if r.get('content') is None and r.get('markdown')]
+        if not todo:
+            return
+        texts = [r['markdown'] for r in todo]
+        if self.pool is not None:
+            html = self.pool.map(render_markdown, texts,
+                                 max(1, len(texts) / (self.workers * 4)))
+        else:
+            html = map(render_markdown, texts)
+        for r, content in zip(todo, html):
+            r['content'] = content
+
+    def unique_slug(self, post_id, slug):
+        slug = slugify(slug)[:50]
+        if slug in self.slugs:
+            slug = "%s-%d" % (slug[:40], post_id)
+        self.slugs.add(slug)
+        return slug
+
+    def resolve_tags(self, names):
+        """
+        Returns {slug: tag id} for tag names, inserting the missing
+        tags with one statement.
+        """
+        wanted = {}
+        for name in names:
+            name = name.strip()
+            slug = slugify(name)
+            if slug:
+                wanted.setdefault(slug, name.lower())
+
+        missing = [dict(slug=slug, name=name) for slug, name in wanted.items()
+                   if slug not in self.tag_ids]
+        if missing:
+            db.session.execute(Tag.__table__.insert(), missing)
+            slugs = [t['slug'] for t in missing]
+            self.tag_ids.update(db.session.query(Tag.slug, Tag.id) \
+                                  .filter(Tag.slug.in_(slugs)).all())
+
+        return dict((slug, self.tag_ids[slug]) for slug in wanted)
+
+    def insert_posts(self, records):
+        kept = []
+        for r in records:
+            if r.get('author') not in self.user_ids:
+                self.skip('post', r, "unknown author %r" % r.get('author'))
+            else:
+                kept.append(r)
+        records = kept
+        if not records:
+            return 0
+
+        self.render(records)
+
+        taglists = [[t for t in (r.get('tags') or '').split(',') if t.strip()]
+                    for r in records]
+        self.resolve_tags(sum(taglists, []))
+
+        rows = []
+        links = []
+        for r, taglist in zip(records, taglists):
+            created = parse_date(r.get('created_date'))
+            title = r['title'].lower().strip()
+            rows.append(dict(id=r['id'],
+                             author_id=self.user_ids[r['author']],
+                             title=title,
+                             slug=self.unique_slug(r['id'], r.get('slug') or title),
+                             content=r.get('content') or u'',
+                             tags=r.get('tags'),
+                             num_comments=0,
+                             created_date=created,
+                             update_time=parse_date(r.get('update_time') or
+                                                    r.get('created_date'))))
+            for slug in set(slugify(t.strip()) for t in taglist) & set(self.tag_ids):
+                links.append(dict(post_id=r['id'], tag_id=self.tag_ids[slug]))
+
+        db.session.execute(Post.__table__.insert(), rows)
+        if links:
+            db.session.execute(post_tags.insert(), links)
+        return len(rows)
+
+    def insert_comments(self, records):
+        rows = []
+        for r in records:
+            if r['post'] in self.skipped_ids['post']:
+                self.skip('comment', r, "post %s was skipped" % r['post'])
+                continue
+            if r.get('parent') in self.skipped_ids['comment']:
+                self.skip('comment', r, "parent %s was skipped" % r['parent'])
+                continue
+            author_id = self.user_ids.get(r.get('author'))
+            email = r.get('email')
+            rows.append(dict(id=r['id'],
+                             post_id=r['post'],
+                             parent_id=r.get('parent'),
+                             author_id=author_id,
+                             email=email,
+                             email_hash=email and email_hash(email),
+                             nickname=r.get('nickname'),
+                             website=r.get('website'),
+                             comment=r['comment'],
+                             ip=r.get('ip'),
+                             created_date=parse_date(r.get('created_date'))))
+        if rows:
+            db.session.execute(Comment.__table__.insert(), rows)
+        return len(rows)
+
+    def finish(self):
+        """
+        The counts left out of the batched inserts, in one pass.
+        """
+        posts = Post.__table__
+        comments = Comment.__table__
+
+        num_comments = db.select([db.func.count(comments.c.id)]) \
+                         .where(comments.c.post_id==posts.c.id).as_scalar()
+        db.session.execute(posts.update().values(num_comments=num_comments))
+
+        # posts and comments were inserted with their ids, past the
+        # sequences that number new rows on PostgreSQL
+        dialect = db.session.get_bind(Post.__mapper__).dialect.name
+        if dialect in ('postgresql', 'postgres'):
+            for table in (posts, comments):
+                db.session.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                                   "COALESCE(MAX(id), 0) + 1, false) FROM %s" % 
+                                   (table.name, table.name))
+        db.session.commit()
+
+        Archive.query.rebuild()
+        # the Cache of flaskext.cache has no clear()
+        cache.cache.clear()
@@ -25,16 +25,19 @@ import calendar
 import datetime
 import httplib
 import os
+import re
 import rfc822
 import sys
 import tempfile
 import textwrap
+import threading
 import time
 import urllib
 import urllib2
 import urlparse
 import gzip
 import StringIO
+import Queue
 
 try:
   # Python >= 2.6
@@ -66,6 +69,10 @@ import oauth2 as oauth
 
 CHARACTER_LIMIT = 140
 
+# Concurrency limits used by Batch() and Api._FetchUrl
+MAX_CONNECTIONS_PER_HOST = 4
+MAX_BATCH_WORKERS = 8
+
 # A singleton representing a lazily instantiated FileCache.
 DEFAULT_CACHE = object()
 
@@ -1851,6 +1858,431 @@ class Url(object):
                    expanded_url=data.get('expanded_url', None))
 
 
+class _JsonField(object):
+    '''A read-only attribute backed by one key of a decoded JSON dict.'''
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj._data.get(self.key)
+
+
+class _JsonObject(object):
+    '''A read-only attribute that builds a nested object from a decoded
+    JSON dict on first access and keeps it in a slot of the owner.
+
+    The factory is given the nested JSON value and should return the
+    materialized object.
+    '''
+
+    __slots__ = ('factory', 'slot')
+
+    def __init__(self, factory, slot):
+        self.factory = factory
+        self.slot = slot
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.factory(obj._data)
+            setattr(obj, self.slot, value)
+            return value
+
+
+def _Entities(key, factory):
+    '''Returns a _JsonObject factory for a list of entities[key].'''
+    def build(data):
+        entities = data.get('entities')
+        if not entities or key not in entities:
+            return None
+        return [factory(e) for e in entities[key]]
+    return build
+
+
+def _Nested(key, factory):
+    '''Returns a _JsonObject factory for a single nested object.'''
+    def build(data):
+        value = data.get(key)
+        if value is None:
+            return None
+        return factory(value)
+    return build
+
+
+class _LazyModel(object):
+    '''Base class for the lazy models.
+
+    A lazy model only keeps a reference to the decoded JSON dict; scalar
+    properties are looked up in it on access and nested objects are
+    built the first time they are used. Instances are read-only.
+    '''
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __eq__(self, other):
+        try:
+            return other and self.AsDict() == other.AsDict()
+        except AttributeError:
+            return False
+
+    def __str__(self):
+        return self.AsJsonString()
+
+    def AsJsonString(self):
+        '''A JSON string representation of this instance.'''
+        return simplejson.dumps(self._data, sort_keys=True)
+
+    def AsDict(self):
+        '''A copy of the decoded JSON dict this instance wraps.'''
+        return dict(self._data)
+
+
+class LazyStatus(_LazyModel):
+    '''A read-only twitter.Status backed by the decoded JSON dict.
+
+    Exposes the same properties as twitter.Status, plus
+    status.retweeted_status. The user, entities and retweeted status are
+    only built when first accessed.
+    '''
+
+    __slots__ = ('_user', '_urls', '_user_mentions', '_hashtags',
+                 '_retweeted_status', '_now')
+
+    created_at = _JsonField('created_at')
+    favorited = _JsonField('favorited')
+    id = _JsonField('id')
+    text = _JsonField('text')
+    location = _JsonField('location')
+    in_reply_to_screen_name = _JsonField('in_reply_to_screen_name')
+    in_reply_to_user_id = _JsonField('in_reply_to_user_id')
+    in_reply_to_status_id = _JsonField('in_reply_to_status_id')
+    truncated = _JsonField('truncated')
+    source = _JsonField('source')
+    geo = _JsonField('geo')
+    place = _JsonField('place')
+    coordinates = _JsonField('coordinates')
+    contributors = _JsonField('contributors')
+
+    created_at_in_seconds = property(Status.GetCreatedAtInSeconds.im_func)
+    relative_created_at = property(Status.GetRelativeCreatedAt.im_func)
+
+    def GetNow(self):
+        try:
+            return self._now
+        except AttributeError:
+            self._now = time.time()
+            return self._now
+
+    def SetNow(self, now):
+        self._now = now
+
+    now = property(GetNow, SetNow,
+                     doc='The wallclock time for this status instance.')
+
+    def SetUser(self, user):
+        '''Replace the twitter.User posting this status message.'''
+        self._user = user
+
+    @staticmethod
+    def NewFromJsonDict(data):
+        '''Create a new instance wrapping a JSON dict.
+
+        Args:
+          data: A JSON dict, as converted from the JSON in the twitter API
+        Returns:
+          A twitter.LazyStatus instance
+        '''
+        return LazyStatus(data)
+
+
+class LazyUser(_LazyModel):
+    '''A read-only twitter.User backed by the decoded JSON dict.
+
+    Exposes the same properties as twitter.User. The user's latest status
+    is only built when first accessed.
+    '''
+
+    __slots__ = ('_status',)
+
+    id = _JsonField('id')
+    name = _JsonField('name')
+    screen_name = _JsonField('screen_name')
+    location = _JsonField('location')
+    description = _JsonField('description')
+    url = _JsonField('url')
+    profile_image_url = _JsonField('profile_image_url')
+    profile_background_tile = _JsonField('profile_background_tile')
+    profile_background_image_url = _JsonField('profile_background_image_url')
+    profile_sidebar_fill_color = _JsonField('profile_sidebar_fill_color')
+    profile_background_color = _JsonField('profile_background_color')
+    profile_link_color = _JsonField('profile_link_color')
+    profile_text_color = _JsonField('profile_text_color')
+    protected = _JsonField('protected')
+    utc_offset = _JsonField('utc_offset')
+    time_zone = _JsonField('time_zone')
+    statuses_count = _JsonField('statuses_count')
+    followers_count = _JsonField('followers_count')
+    friends_count = _JsonField('friends_count')
+    favourites_count = _JsonField('favourites_count')
+    geo_enabled = _JsonField('geo_enabled')
+
+    @staticmethod
+    def NewFromJsonDict(data):
+        '''Create a new instance wrapping a JSON dict.
+
+        Args:
+          data: A JSON dict, as converted from the JSON in the twitter API
+        Returns:
+          A twitter.LazyUser instance
+        '''
+        return LazyUser(data)
+
+
+LazyStatus.user = _JsonObject(_Nested('user', LazyUser), '_user')
+LazyStatus.retweeted_status = _JsonObject(
+    _Nested('retweeted_status', LazyStatus), '_retweeted_status')
+LazyStatus.urls = _JsonObject(_Entities('urls', Url.NewFromJsonDict), '_urls')
+LazyStatus.user_mentions = _JsonObject(
+    _Entities('user_mentions', LazyUser), '_user_mentions')
+LazyStatus.hashtags = _JsonObject(
+    _Entities('hashtags', Hashtag.NewFromJsonDict), '_hashtags')
+
+LazyUser.status = _JsonObject(_Nested('status', LazyStatus), '_status')
+
+
+# Connection slots per remote host, shared by every Api instance
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _HostSemaphore(url):
+    '''Returns the semaphore bounding concurrent requests to url's host.'''
+    host = urlparse.urlparse(url)[1]
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def Batch(calls, max_workers=MAX_BATCH_WORKERS, return_exceptions=False):
+    '''Run independent Api calls concurrently on a bounded set of threads.
+
+    The calls may belong to different Api instances. Requests to the same
+    host never exceed MAX_CONNECTIONS_PER_HOST at once, and each Api stops
+    sending requests once its rate limit is used up.
+
+      >>> timelines = twitter.Batch([(api.GetUserTimeline, (), {'count': 20})
+      ...                            for api in apis])
+
+    Args:
+      calls:
+        A sequence of callables, or of (callable, args, kwargs) tuples.
+      max_workers:
+        The maximum number of threads to use.  A single call, or a
+        max_workers of 1, runs in the calling thread. [Optional]
+      return_exceptions:
+        If True, a failed call leaves its exception in the results.
+        Otherwise the first failure is raised once every call has
+        finished.  Defaults to False. [Optional]
+
+    Returns:
+      A list with the result of each call, in the order of calls.
+    '''
+    normalized = []
+    for call in calls:
+        if callable(call):
+            normalized.append((call, (), {}))
+        else:
+            func, args, kwargs = (tuple(call) + ((), {}))[:3]
+            normalized.append((func, args or (), kwargs or {}))
+
+    results = [None] * len(normalized)
+    errors  = [None] * len(normalized)
+
+    def run(index):
+        func, args, kwargs = normalized[index]
+        try:
+            results[index] = func(*args, **kwargs)
+        except Exception:
+            errors[index] = sys.exc_info()
+
+    workers = min(max_workers, len(normalized))
+
+    if workers <= 1:
+        for index in range(len(normalized)):
+            run(index)
+    else:
+        queue = Queue.Queue()
+        for index in range(len(normalized)):
+            queue.put(index)
+
+        def worker():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                run(index)
+
+        threads = [threading.Thread(target=worker) for i in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for index, error in enumerate(errors):
+        if error is None:
+            continue
+        if return_exceptions:
+            results[index] = error[1]
+        else:
+            raise error[0], error[1], error[2]
+
+    return results
+
+
+class RateLimitError(TwitterError):
+    '''Raised when a request is deferred or refused for lack of quota.'''
+
+
+def _IntHeader(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter(object):
+    '''Schedules requests against the quotas Twitter reports per endpoint.
+
+    Each endpoint is a token bucket filled from the X-RateLimit-Limit,
+    X-RateLimit-Remaining and X-RateLimit-Reset headers of its last
+    response, and refilled at the reset time.  While plenty of hits are
+    left requests go straight through.  Once only `reserve` of the limit
+    remains, the remaining hits are spread evenly until the reset:
+    requests wait for their turn, and a request that would have to wait
+    longer than `max_wait` seconds is deferred with a RateLimitError.
+
+    The counters dict counts requests sent, requests that waited,
+    requests deferred, responses throttled by Twitter, and responses
+    served from a stale cache instead.
+    '''
+
+    THROTTLED = (420, 429)
+
+    def __init__(self, reserve=0.1, max_wait=2.0):
+        self.reserve  = reserve
+        self.max_wait = max_wait
+        self.counters = dict.fromkeys(('sent', 'waited', 'deferred',
+                                       'throttled', 'stale'), 0)
+        self._buckets = {}
+        self._lock    = threading.Lock()
+
+    @staticmethod
+    def Endpoint(url):
+        '''Returns the endpoint of url, ignoring numeric ids and the query.'''
+        host, path = urlparse.urlparse(url)[1:3]
+        return host + re.sub(r'(?<=.)/\d+', '/:id', path)
+
+    def Count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def GetBuckets(self):
+        '''Returns a copy of the known quota of each endpoint.'''
+        with self._lock:
+            return dict((endpoint, dict(bucket))
+                        for endpoint, bucket in self._buckets.items())
+
+    def Acquire(self, url):
+        '''Take one hit for url's endpoint, waiting for it if needed.
+
+        Raises:
+          RateLimitError if no hit will be available within max_wait.
+        '''
+        endpoint = self.Endpoint(url)
+        wait = 0
+
+        with self._lock:
+            bucket = self._buckets.get(endpoint)
+            now = time.time()
+
+            if bucket is not None and now >= bucket['reset']:
+                del self._buckets[endpoint]
+                bucket = None
+
+            if bucket is not None:
+                if bucket['remaining'] <= 0:
+                    wait = bucket['reset'] - now
+                elif bucket['remaining'] <= bucket['limit'] * self.reserve:
+                    interval = (bucket['reset'] - now) / bucket['remaining']
+                    wait = max(0, bucket['next'] - now)
+                    if wait <= self.max_wait:
+                        bucket['next'] = now + wait + interval
+
+                if wait > self.max_wait:
+                    self.counters['deferred'] += 1
+                    raise RateLimitError('Rate limit for %s exceeded, resets '
+                                         'in %d seconds' % (endpoint, bucket['reset'] - now))
+
+                bucket['remaining'] -= 1
+
+            self.counters['sent'] += 1
+            if wait > 0:
+                self.counters['waited'] += 1
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def Update(self, url, headers, status=200):
+        '''Record the quota reported in the response headers for url.
+
+        Raises:
+          RateLimitError if the response says the request was throttled.
+        '''
+        endpoint  = self.Endpoint(url)
+        limit     = _IntHeader(headers, 'x-ratelimit-limit')
+        remaining = _IntHeader(headers, 'x-ratelimit-remaining')
+        reset     = _IntHeader(headers, 'x-ratelimit-reset')
+
+        throttled = status in self.THROTTLED or (status == 400 and remaining == 0)
+
+        if remaining is None and not throttled:
+            return
+
+        with self._lock:
+            now = time.time()
+            if throttled:
+                self.counters['throttled'] += 1
+                remaining = 0
+                reset = reset or now + (_IntHeader(headers, 'retry-after') or 60)
+
+            bucket = self._buckets.setdefault(endpoint, {'next': 0})
+            bucket['limit']     = limit or max(remaining, bucket.get('limit', 0))
+            bucket['remaining'] = remaining
+            bucket['reset']     = reset or now + 3600
+
+        if throttled:
+            raise RateLimitError('Rate limit for %s exceeded' % endpoint)
+
+
 class Api(object):
     '''A python interface into the Twitter API
 
@@ -1930,7 +2362,8 @@ class Api(object):
                    shortner=None,
                    base_url=None,
                    use_gzip_compression=False,
-                   debugHTTP=False):
+                   debugHTTP=False,
+                   lazy_models=False):
         '''Instantiate a new twitter.Api object.
 
         Args:
@@ -1963,6 +2396,10 @@ class Api(object):
           debugHTTP:
             Set to True to enable debug output from urllib2 when performing
             any HTTP requests.  Defaults to False. [Optional]
+          lazy_models:
+            Set to True to return twitter.LazyStatus and twitter.LazyUser
+            instances, which wrap the decoded JSON and only build nested
+            objects on access.  Defaults to False. [Optional]
         '''
         self.SetCache(cache)
         self._urllib         = urllib2
@@ -1972,6 +2409,15 @@ class Api(object):
         self._debugHTTP      = debugHTTP
         self._oauth_consumer = None
 
+        self._rate_limiter   = RateLimiter()
+
+        if lazy_models:
+            self._status_class = LazyStatus
+            self._user_class   = LazyUser
+        else:
+            self._status_class = Status
+            self._user_class   = User
+
         self._InitializeRequestHeaders(request_headers)
         self._InitializeUserAgent()
         self._InitializeDefaultParameters()
@@ -2073,7 +2519,7 @@ class Api(object):
 
         self._CheckForTwitterError(data)
 
-        return [Status.NewFromJsonDict(x) for x in data]
+        return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def FilterPublicTimeline(self,
                                term,
@@ -2173,21 +2619,25 @@ class Api(object):
 
         self._CheckForTwitterError(data)
 
-        results = []
-
-        for x in data['results']:
-            temp = Status.NewFromJsonDict(x)
+        if query_users:
+            # Build user objects with new requests, in one parallel pass
+            users = Batch([(self.GetUser, (urllib.quote(x['from_user']),))
+                           for x in data['results']])
+        else:
+            users = [self._user_class.NewFromJsonDict(
+                        {'screen_name': x['from_user'],
+                         'profile_image_url': x['profile_image_url']})
+                     for x in data['results']]
 
-            if query_users:
-                # Build user object with new request
-                temp.user = self.GetUser(urllib.quote(x['from_user']))
-            else:
-                temp.user = User(screen_name=x['from_user'], profile_image_url=x['profile_image_url'])
+        results = []
 
+        for x, user in zip(data['results'], users):
+            temp = self._status_class.NewFromJsonDict(x)
+            temp.SetUser(user)
             results.append(temp)
 
         # Return built list of statuses
-        return results # [Status.NewFromJsonDict(x) for x in data['results']]
+        return results
 
     def GetTrendsCurrent(self, exclude=None):
         '''Get the current top trending topics
@@ -2353,7 +2803,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [Status.NewFromJsonDict(x) for x in data]
+        return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def GetUserTimeline(self,
                           id=None,
@@ -2455,7 +2905,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [Status.NewFromJsonDict(x) for x in data]
+        return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def GetStatus(self, id):
         '''Returns a single status message.
@@ -2479,7 +2929,7 @@ class Api(object):
         json = self._FetchUrl(url)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return Status.NewFromJsonDict(data)
+        return self._status_class.NewFromJsonDict(data)
 
     def DestroyStatus(self, id):
         '''Destroys the status specified by the required ID parameter.
@@ -2503,7 +2953,7 @@ class Api(object):
         json = self._FetchUrl(url, post_data={'id': id})
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return Status.NewFromJsonDict(data)
+        return self._status_class.NewFromJsonDict(data)
 
     def PostUpdate(self, status, in_reply_to_status_id=None):
         '''Post a twitter status message from the authenticated user.
@@ -2543,7 +2993,7 @@ class Api(object):
         json = self._FetchUrl(url, post_data=data)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return Status.NewFromJsonDict(data)
+        return self._status_class.NewFromJsonDict(data)
 
     def PostUpdates(self, status, continuation=None, **kwargs):
         '''Post one or more twitter status messages from the authenticated user.
@@ -2623,7 +3073,7 @@ class Api(object):
          json = self._FetchUrl(url, parameters=parameters)
          data = simplejson.loads(json)
          self._CheckForTwitterError(data)
-         return [Status.NewFromJsonDict(x) for x in data]
+         return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def GetReplies(self, since=None, since_id=None, page=None):
         '''Get a sequence of status messages representing the 20 most
@@ -2658,7 +3108,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [Status.NewFromJsonDict(x) for x in data]
+        return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def GetRetweets(self, statusid):
         '''Returns up to 100 of the first retweets of the tweet identified
@@ -2678,7 +3128,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [Status.NewFromJsonDict(s) for s in data]
+        return [self._status_class.NewFromJsonDict(s) for s in data]
 
     def GetFriends(self, user=None, cursor=-1):
         '''Fetch the sequence of twitter.User instances, one for each friend.
@@ -2704,7 +3154,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [User.NewFromJsonDict(x) for x in data['users']]
+        return [self._user_class.NewFromJsonDict(x) for x in data['users']]
 
     def GetFriendIDs(self, user=None, cursor=-1):
           '''Returns a list of twitter user id's for every person
@@ -2771,7 +3221,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [User.NewFromJsonDict(x) for x in data]
+        return [self._user_class.NewFromJsonDict(x) for x in data]
 
     def GetFeatured(self):
         '''Fetch the sequence of twitter.User instances featured on twitter.com
@@ -2785,7 +3235,7 @@ class Api(object):
         json = self._FetchUrl(url)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [User.NewFromJsonDict(x) for x in data]
+        return [self._user_class.NewFromJsonDict(x) for x in data]
 
     def UsersLookup(self, user_id=None, screen_name=None, users=None):
         '''Fetch extended information for the specified users.
@@ -2829,7 +3279,7 @@ class Api(object):
         json = self._FetchUrl(url, parameters=parameters)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return [User.NewFromJsonDict(u) for u in data]
+        return [self._user_class.NewFromJsonDict(u) for u in data]
 
     def GetUser(self, user):
         '''Returns a single user.
@@ -2846,7 +3296,7 @@ class Api(object):
         json = self._FetchUrl(url)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return User.NewFromJsonDict(data)
+        return self._user_class.NewFromJsonDict(data)
 
     def GetDirectMessages(self, since=None, since_id=None, page=None):
         '''Returns a list of the direct messages sent to the authenticating user.
@@ -2939,7 +3389,7 @@ class Api(object):
         json = self._FetchUrl(url, post_data={'user': user})
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return User.NewFromJsonDict(data)
+        return self._user_class.NewFromJsonDict(data)
 
     def DestroyFriendship(self, user):
         '''Discontinues friendship with the user specified in the user parameter.
@@ -2955,7 +3405,7 @@ class Api(object):
         json = self._FetchUrl(url, post_data={'user': user})
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return User.NewFromJsonDict(data)
+        return self._user_class.NewFromJsonDict(data)
 
     def CreateFavorite(self, status):
         '''Favorites the status specified in the status parameter as the authenticating user.
@@ -2972,7 +3422,7 @@ class Api(object):
         json = self._FetchUrl(url, post_data={'id': status.id})
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return Status.NewFromJsonDict(data)
+        return self._status_class.NewFromJsonDict(data)
 
     def DestroyFavorite(self, status):
         '''Un-favorites the status specified in the ID parameter as the authenticating user.
@@ -2989,7 +3439,7 @@ class Api(object):
         json = self._FetchUrl(url, post_data={'id': status.id})
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return Status.NewFromJsonDict(data)
+        return self._status_class.NewFromJsonDict(data)
 
     def GetFavorites(self,
                        user=None,
@@ -3023,7 +3473,7 @@ class Api(object):
 
         self._CheckForTwitterError(data)
 
-        return [Status.NewFromJsonDict(x) for x in data]
+        return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def GetMentions(self,
                       since_id=None,
@@ -3069,7 +3519,7 @@ class Api(object):
 
         self._CheckForTwitterError(data)
 
-        return [Status.NewFromJsonDict(x) for x in data]
+        return [self._status_class.NewFromJsonDict(x) for x in data]
 
     def CreateList(self, user, name, mode=None, description=None):
         '''Creates a new list with the give name
@@ -3236,7 +3686,7 @@ class Api(object):
         json = self._FetchUrl(url)
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return User.NewFromJsonDict(data)
+        return self._user_class.NewFromJsonDict(data)
 
     def VerifyCredentials(self):
         '''Returns a twitter.User instance if the authenticating user is valid.
@@ -3257,7 +3707,7 @@ class Api(object):
                 raise http_error
         data = simplejson.loads(json)
         self._CheckForTwitterError(data)
-        return User.NewFromJsonDict(data)
+        return self._user_class.NewFromJsonDict(data)
 
     def SetCache(self, cache):
         '''Override the default cache.  Set to None to prevent caching.
@@ -3289,6 +3739,21 @@ class Api(object):
         '''
         self._cache_timeout = cache_timeout
 
+    def GetRateLimiter(self):
+        '''Returns the twitter.RateLimiter scheduling this instance's
+        requests, whose counters attribute reports its activity.'''
+        return self._rate_limiter
+
+    def SetRateLimiter(self, rate_limiter):
+        '''Override the default twitter.RateLimiter.
+
+        Args:
+          rate_limiter:
+            A twitter.RateLimiter instance, which may be shared with
+            other Api instances using the same credentials.
+        '''
+        self._rate_limiter = rate_limiter
+
     def SetUserAgent(self, user_agent):
         '''Override the default user agent
 
@@ -3413,6 +3878,22 @@ class Api(object):
     def _InitializeDefaultParameters(self):
         self._default_params = {}
 
+    def _OpenUrl(self, opener, url, encoded_post_data):
+        '''Send a request, honouring the per-host and rate limits.'''
+        self._rate_limiter.Acquire(url)
+        semaphore = _HostSemaphore(url)
+        semaphore.acquire()
+        try:
+            try:
+                response = opener.open(url, encoded_post_data)
+            except urllib2.HTTPError, http_error:
+                self._rate_limiter.Update(url, http_error.info(), http_error.code)
+                raise
+            self._rate_limiter.Update(url, response.info(), response.code)
+            return self._DecompressGzippedResponse(response)
+        finally:
+            semaphore.release()
+
     def _DecompressGzippedResponse(self, response):
         raw_data = response.read()
         if response.headers.get('content-encoding', None) == 'gzip':
@@ -3564,8 +4045,7 @@ class Api(object):
 
         # Open and return the URL immediately if we're not going to cache
         if encoded_post_data or no_cache or not self._cache or not self._cache_timeout:
-            response = opener.open(url, encoded_post_data)
-            url_data = self._DecompressGzippedResponse(response)
+            url_data = self._OpenUrl(opener, url, encoded_post_data)
             opener.close()
         else:
             # Unique keys are a combination of the url and the oAuth Consumer Key
@@ -3580,11 +4060,14 @@ class Api(object):
             # If the cached version is outdated then fetch another and store it
             if not last_cached or time.time() >= last_cached + self._cache_timeout:
                 try:
-                    response = opener.open(url, encoded_post_data)
-                    url_data = self._DecompressGzippedResponse(response)
+                    url_data = self._OpenUrl(opener, url, encoded_post_data)
                     self._cache.Set(key, url_data)
-                except urllib2.HTTPError, e:
-                    print e
+                except (RateLimitError, IOError, httplib.HTTPException):
+                    # Serve the stale copy rather than failing
+                    url_data = last_cached and self._cache.Get(key)
+                    if not url_data:
+                        raise
+                    self._rate_limiter.Count('stale')
                 opener.close()
             else:
                 url_data = self._cache.Get(key)
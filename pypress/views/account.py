@@ -15,7 +15,9 @@ try:
 except:
   from cgi import parse_qsl
 
-import oauth2 as oauth
+from pypress.lazy import LazyModule
+
+oauth = LazyModule('oauth2')
 
 from flask import Module, Response, request, flash, jsonify, g, current_app,\
     abort, redirect, url_for, session
@@ -26,11 +28,11 @@ from flaskext.principal import identity_changed, Identity, AnonymousIdentity
 from pypress.helpers import render_template, cached
 from pypress.permissions import auth, admin 
 from pypress.extensions import db
+from pypress.passwords import PoolBusy
 
 from pypress.models import User, UserCode, Twitter
 from pypress.forms import LoginForm, SignupForm
 
-from pypress import twitter
 
 account = Module(__name__)
 
@@ -47,8 +49,12 @@ def login():
 
     if form.validate_on_submit():
 
-        user, authenticated = User.query.authenticate(form.login.data,
-                                                      form.password.data)
+        try:
+            user, authenticated = User.query.authenticate(form.login.data,
+                                                          form.password.data)
+        except PoolBusy:
+            flash(_("Too many logins at the moment, please try again"), "error")
+            return render_template("account/login.html", form=form)
 
         if user and authenticated:
             session.permanent = form.remember.data
@@ -83,7 +89,11 @@ def signup():
 
         if code:
             user = User(role=code.role)
-            form.populate_obj(user)
+            try:
+                form.populate_obj(user)
+            except PoolBusy:
+                flash(_("Too many signups at the moment, please try again"), "error")
+                return render_template("account/signup.html", form=form)
 
             db.session.add(user)
             db.session.delete(code)
@@ -171,11 +181,14 @@ def twitter_callback():
     if resp['status'] != '200':
         return 'The request for a Token did not succeed: %s' % resp['status']
     else:
-        if g.user.twitter is None:
-            g.user.twitter = Twitter()
+        user = g.user.load() or abort(401)
+
+        if user.twitter is None:
+            user.twitter = Twitter()
         
-        g.user.twitter.token = access_token['oauth_token']
-        g.user.twitter.token_secret = access_token['oauth_token_secret']
+        user.twitter.token = access_token['oauth_token']
+        user.twitter.token_secret = access_token['oauth_token_secret']
+        user.twitter.screen_name = access_token.get('screen_name')
 
         db.session.commit()
 
@@ -8,60 +8,414 @@
 
 import datetime
 import os
+import gzip
+import hashlib
+import tempfile
 
-from werkzeug.contrib.atom import AtomFeed
+from abc import ABCMeta, abstractmethod
+from StringIO import StringIO
 
-from flask import Module, request, url_for
+from werkzeug.contrib.atom import AtomFeed, FeedEntry
 
-from pypress.helpers import cached
+from flask import Module, request, url_for, current_app, redirect, abort
 
-from pypress.models import User, Post, Tag
+from pypress import signals
+from pypress.extensions import db, cache
+from pypress.helpers import LRUCache
+from pypress.compress import compress_variants, precompressed_response
+
+from pypress.models import User, Post, Tag, Comment
 
 feeds = Module(__name__)
 
-class PostFeed(AtomFeed):
+class CachedEntry(object):
+    """
+    A serialized feed entry, in place of werkzeug's FeedEntry.
+    """
+
+    # every serialized entry has an author
+    author = True
+
+    def __init__(self, xml, updated):
+        self.xml = xml
+        self.updated = updated
+
+    def generate(self):
+        yield self.xml
+
+
+class CachedFeed(AtomFeed):
+    """
+    Atom feed of model instances. The XML of each entry is cached by
+    id and version (a column changing whenever the entry should), and 
+    the document is streamed from those fragments, so only new or 
+    edited rows are loaded and serialized again.
+
+    Subclasses set `model` and `version` and build the FeedEntry in
+    `entry()`.
+    """
+
+    __metaclass__ = ABCMeta
+
+    model = None
+    version = None
+
+    # rows loaded at once to serialize missing entries
+    CHUNK_SIZE = 50
+
+    HISTORY_NS = "http://purl.org/syndication/history/1.0"
+
+    # marks an RFC 5005 archive document
+    archive = False
+
+    @abstractmethod
+    def entry(self, obj):
+        """
+        The FeedEntry of a model instance.
+        """
+
+    def entry_key(self, obj_id, version):
+        return "feeds/%s/%d/%s" % (self.model.__tablename__, obj_id, version)
+
+    def serialize(self, obj):
+        xml = u''.join(self.entry(obj).generate())
+
+        cache.set(self.entry_key(obj.id, getattr(obj, self.version)), xml,
+                  timeout=current_app.config.get('FEED_ENTRY_TIMEOUT', 86400))
+
+        return xml
+
+    def add_item(self, obj):
+        self.entries.append(CachedEntry(self.serialize(obj), 
+                                        getattr(obj, self.version)))
+
+    def add_items(self, query, limit=None):
+        """
+        Adds the first rows of query, loading full rows only for 
+        entries missing from the cache.
+        """
+        if limit is None:
+            limit = current_app.config.get('FEED_ENTRIES', 15)
+
+        model = self.model
+
+        rows = list(query.limit(limit).values(model.id, 
+                                              getattr(model, self.version)))
+
+        fragments = [cache.get(self.entry_key(*row)) for row in rows]
+
+        missing = [obj_id for (obj_id, version), xml \
+                   in zip(rows, fragments) if xml is None]
+
+        serialized = {}
+        for i in range(0, len(missing), self.CHUNK_SIZE):
+            chunk = missing[i:i + self.CHUNK_SIZE]
+            for obj in model.query.filter(model.id.in_(chunk)):
+                serialized[obj.id] = self.serialize(obj)
+
+        for (obj_id, version), xml in zip(rows, fragments):
+            if xml is None:
+                xml = serialized.get(obj_id)
+                if xml is None:
+                    # deleted in the meantime
+                    continue
+            self.entries.append(CachedEntry(xml, version))
+
+    def generate(self):
+        for chunk in AtomFeed.generate(self):
+            if self.archive and chunk.startswith(u'<feed '):
+                chunk = chunk.replace(u'<feed ', 
+                                      u'<feed xmlns:fh="%s" ' % self.HISTORY_NS, 1)
+                chunk += u'  <fh:archive />\n'
+            yield chunk
+
+    def get_response(self):
+        return current_app.response_class(self.generate(), 
+                                          mimetype='application/atom+xml')
+
+
+class PostFeed(CachedFeed):
+
+    model = Post
+    version = 'update_time'
+
+    def entry(self, post):
+        return FeedEntry(post.title,
+                         unicode(post.content),
+                         content_type="html",
+                         author=post.author.username,
+                         url=post.permalink,
+                         updated=post.update_time,
+                         published=post.created_date)
+
+    add_post = CachedFeed.add_item
+    add_posts = CachedFeed.add_items
+
+
+class CommentFeed(CachedFeed):
+
+    model = Comment
+    version = 'created_date'
+
+    def entry(self, comment):
+        return FeedEntry(u"%s: %s" % (comment.author.nickname, comment.post.title),
+                         unicode(comment.markdown),
+                         content_type="html",
+                         author=comment.author.nickname,
+                         url=comment.permalink,
+                         updated=comment.created_date)
+
+    add_comment = CachedFeed.add_item
+    add_comments = CachedFeed.add_items
+
+
+# rendered feed documents, keyed by URL
+rendered_feeds = LRUCache(maxsize=100, timeout=300)
+
+
+def clear_rendered_feeds(sender):
+    rendered_feeds.clear()
+
+
+for signal in (signals.post_added, signals.post_updated, signals.post_deleted,
+               signals.comment_added, signals.comment_deleted):
+    signal.connect(clear_rendered_feeds)
+
+
+def feed_response(build):
+    """
+    Shared path of the feed views: serves the document rendered by
+    build() from a bounded LRU, precompressed and with an ETag for 
+    conditional GET.
+    build() returns a CachedFeed and is only called on a miss.
+    """
+    rendered = rendered_feeds.get(request.url)
+
+    if rendered is None:
+        body = u''.join(build().generate()).encode('utf8')
+        # compressed once here rather than per request
+        rendered = (body, compress_variants(body), hashlib.md5(body).hexdigest())
+        rendered_feeds.set(request.url, rendered)
+
+    body, variants, etag = rendered
+
+    response = precompressed_response(body, variants, 'application/atom+xml', etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = rendered_feeds.timeout
+    return response
+
 
-    def add_post(self, post):
+def archive_size():
+    return current_app.config.get('FEED_ARCHIVE_SIZE', 50)
 
-        self.add(post.title,
-                 unicode(post.content),
-                 content_type="html",
-                 author=post.author.username,
-                 url=post.permalink,
-                 updated=post.update_time,
-                 published=post.created_date)
+
+def archive_page_of(post_id):
+    """
+    Archive pages hold fixed ranges of post ids, oldest first, so a
+    later post never changes a page. Edits and deletions do.
+    """
+    return (post_id - 1) // archive_size() + 1
+
+
+def archive_path(page):
+    archive_dir = os.path.join(current_app.root_path, 
+                               current_app.config.get('FEED_ARCHIVE_DIR', 
+                                                      'cache/feeds'))
+    return os.path.join(archive_dir, "page-%d.xml.gz" % page)
+
+
+def archive_link(rel, page):
+    return dict(rel=rel, href=url_for('feeds.page', page=page, _external=True))
+
+
+def write_archive_page(page, path):
+    """
+    Renders a complete archive page and stores it gzipped.
+    """
+    size = archive_size()
+
+    feed = PostFeed("laoqiu blog - archive %d" % page,
+                    feed_url=url_for('feeds.page', page=page, _external=True),
+                    url=request.url_root,
+                    links=[dict(rel='current', 
+                                href=url_for('feeds.index', _external=True)),
+                           archive_link('next-archive', page + 1)])
+    if page > 1:
+        feed.links.append(archive_link('prev-archive', page - 1))
+    feed.archive = True
+
+    feed.add_posts(Post.query.filter(Post.id.between((page - 1) * size + 1, 
+                                                     page * size)) \
+                             .order_by(Post.id.desc()),
+                   limit=size)
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    out = os.fdopen(fd, 'wb')
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    for chunk in feed.generate():
+        f.write(chunk.encode('utf8'))
+    f.close()
+    out.close()
+    os.rename(temp_path, path)
+
+
+def remove_archive_page(post):
+    path = archive_path(archive_page_of(post.id))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+signals.post_updated.connect(remove_archive_page)
+signals.post_deleted.connect(remove_archive_page)
 
 
 @feeds.route("/")
-@cached()
 def index():
-    feed = PostFeed("laoqiu blog - lastest",
-                    feed_url=request.url,
-                    url=request.url_root)
 
-    posts = Post.query.order_by('created_date desc').limit(15)
+    def build():
+        feed = PostFeed("laoqiu blog - lastest",
+                        feed_url=request.url,
+                        url=request.url_root)
+
+        max_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+        head = archive_page_of(max_id) if max_id else 1
+
+        # the subscription document covers every post of the incomplete 
+        # page, so it links back to the newest complete one
+        limit = current_app.config.get('FEED_ENTRIES', 15)
+        if head > 1:
+            feed.links.append(archive_link('prev-archive', head - 1))
+            limit = max(limit, Post.query.filter(
+                Post.id > (head - 1) * archive_size()).count())
+
+        feed.add_posts(Post.query.order_by(Post.id.desc()), limit=limit)
+        return feed
+
+    return feed_response(build)
+
+
+@feeds.route("/page/<int:page>/")
+def page(page):
+
+    max_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+    head = archive_page_of(max_id) if max_id else 1
+
+    if page == head:
+        return redirect(url_for('feeds.index'))
+
+    if page < 1 or page > head:
+        abort(404)
 
-    for post in posts:
-        feed.add_post(post)
+    path = archive_path(page)
+    if not os.path.exists(path):
+        write_archive_page(page, path)
 
-    return feed.get_response()
+    f = open(path, 'rb')
+    data = f.read()
+    f.close()
+
+    if 'gzip' in request.accept_encodings:
+        response = current_app.response_class(data, 
+                                              mimetype='application/atom+xml')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        data = gzip.GzipFile(fileobj=StringIO(data)).read()
+        response = current_app.response_class(data, 
+                                              mimetype='application/atom+xml')
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    # pages are written again when one of their posts is edited or
+    # deleted, so clients revalidate with the ETag
+    response.cache_control.max_age = current_app.config.get('FEED_ARCHIVE_MAX_AGE', 
+                                                            3600)
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @feeds.route("/tag/<slug>/")
-@cached()
 def tag(slug):
 
     tag = Tag.query.filter_by(slug=slug).first_or_404()
 
-    feed = PostFeed("laoqiu blog - %s"  % tag,
-                    feed_url=request.url,
-                    url=request.url_root)
+    def build():
+        feed = PostFeed("laoqiu blog - %s"  % tag,
+                        feed_url=request.url,
+                        url=request.url_root)
+
+        feed.add_posts(tag.posts.order_by(Post.id.desc()))
+        return feed
+
+    return feed_response(build)
+
+
+@feeds.route("/people/<username>/")
+def people(username):
+
+    people = User.query.get_by_username(username)
+
+    def build():
+        feed = PostFeed("laoqiu blog - %s" % people.nickname,
+                        feed_url=request.url,
+                        url=request.url_root)
+
+        feed.add_posts(Post.query.filter(Post.author_id==people.id) \
+                                 .order_by(Post.id.desc()))
+        return feed
+
+    return feed_response(build)
+
+
+@feeds.route("/search/")
+def search():
+
+    keywords = request.args.get('q','').strip()
+
+    if not keywords:
+        return redirect(url_for("feeds.index"))
+
+    def build():
+        feed = PostFeed("laoqiu blog - %s" % keywords,
+                        feed_url=request.url,
+                        url=request.url_root)
+
+        feed.add_posts(Post.query.search(keywords).order_by(Post.id.desc()))
+        return feed
+
+    return feed_response(build)
+
+
+@feeds.route("/comments/")
+def comments():
+
+    def build():
+        feed = CommentFeed("laoqiu blog - comments",
+                           feed_url=request.url,
+                           url=request.url_root)
+
+        feed.add_comments(Comment.query.order_by(Comment.id.desc()))
+        return feed
+
+    return feed_response(build)
+
+
+@feeds.route("/post/<int:post_id>/comments/")
+def post_comments(post_id):
 
-    posts = tag.posts.limit(15)
+    post = Post.query.get_or_404(post_id)
 
-    for post in posts:
-        feed.add_post(post)
+    def build():
+        feed = CommentFeed("laoqiu blog - %s" % post.title,
+                           feed_url=request.url,
+                           url=post.permalink)
 
-    return feed.get_response()
+        feed.add_comments(Comment.query.filter(Comment.post_id==post.id) \
+                                       .order_by(Comment.id.desc()))
+        return feed
 
+    return feed_response(build)
 
@@ -19,7 +19,8 @@ from pypress.permissions import auth, admin
 from pypress.extensions import db, photos
 
 from pypress.models import User, Post, Comment, Tag
-from pypress.forms import CommentForm, TemplateForm, TwitterForm
+from pypress.models.blog import prefetch_author_cards
+from pypress.forms import TemplateForm, TwitterForm, comment_form
 
 frontend = Module(__name__)
 
@@ -31,6 +32,7 @@ frontend = Module(__name__)
 @frontend.route("/<int:year>/<int:month>/page/<int:page>/")
 @frontend.route("/<int:year>/<int:month>/<int:day>/")
 @frontend.route("/<int:year>/<int:month>/<int:day>/page/<int:page>/")
+@cached()
 def index(year=None, month=None, day=None, page=1):
 
     if page<1:page=1
@@ -38,7 +40,9 @@ def index(year=None, month=None, day=None, page=1):
     page_obj = Post.query.archive(year,month,day).as_list() \
                          .paginate(page, per_page=Post.PER_PAGE)
 
-    page_url = lambda page: url_for("post.index",
+    prefetch_author_cards(page_obj.items)
+
+    page_url = lambda page: url_for("frontend.index",
                                     year=year,
                                     month=month,
                                     day=day,
@@ -66,6 +70,8 @@ def search(page=1):
         post = page_obj.items[0]
         return redirect(post.url)
     
+    prefetch_author_cards(page_obj.items)
+
     page_url = lambda page: url_for('frontend.search', 
                                     page=page,
                                     keywords=keywords)
@@ -77,13 +83,24 @@ def search(page=1):
 
 
 @frontend.route("/archive/")
-def archive():
-    
-        
-    return render_template("blog/archive.html")
+@frontend.route("/archive/<int:year>/<int:month>/")
+@cached()
+def archive(year=None, month=None):
+
+    days = None
+    if year and month:
+        days = Post.query.days(year, month)
+        if not days:
+            abort(404)
+
+    return render_template("blog/archive.html",
+                           year=year,
+                           month=month,
+                           days=days)
 
 
 @frontend.route("/tags/")
+@cached()
 def tags():
 
     return render_template("blog/tags.html")
@@ -91,6 +108,7 @@ def tags():
 
 @frontend.route("/tags/<slug>/")
 @frontend.route("/tags/<slug>/page/<int:page>/")
+@cached()
 def tag(slug, page=1):
 
     tag = Tag.query.filter_by(slug=slug).first_or_404()
@@ -98,7 +116,9 @@ def tag(slug, page=1):
     page_obj = tag.posts.as_list() \
                         .paginate(page, per_page=Post.PER_PAGE)
 
-    page_url = lambda page: url_for("post.tag",
+    prefetch_author_cards(page_obj.items)
+
+    page_url = lambda page: url_for("frontend.tag",
                                     slug=slug,
                                     page=page)
 
@@ -138,7 +158,7 @@ def people(username, page=1):
     page_obj = Post.query.filter(Post.author_id==people.id).as_list() \
                          .paginate(page, per_page=Post.PER_PAGE)
     
-    page_url = lambda page: url_for("post.people",
+    page_url = lambda page: url_for("frontend.people",
                                     username=username,
                                     page=page)
 
@@ -166,6 +186,7 @@ def about():
 
 
 @frontend.route("/<int:year>/<int:month>/<int:day>/<slug>/")
+@cached()
 def post(year, month, day, slug):
     
     post = Post.query.get_by_slug(slug)
@@ -186,7 +207,7 @@ def post(year, month, day, slug):
                             post=post,
                             prev_post=prev_post,
                             next_post=next_post,
-                            comment_form=CommentForm())
+                            comment_form=comment_form())
 
 
 @frontend.route("/<slug>/")
@@ -13,16 +13,15 @@ import json
 from flask import Module, Response, request, flash, jsonify, g, current_app, \
     abort, redirect, url_for, session
 
-from flaskext.mail import Message
 from flaskext.babel import gettext as _
 
 from pypress import signals
 from pypress.helpers import render_template, cached, ip2long
 from pypress.permissions import auth 
-from pypress.extensions import db
+from pypress.extensions import db, mail
 
 from pypress.models import User, Post, Comment
-from pypress.forms import PostForm, CommentForm
+from pypress.forms import PostForm, comment_form
 
 post = Module(__name__)
 
@@ -35,12 +34,14 @@ def submit():
 
     if form.validate_on_submit():
 
-        post = Post(author=g.user)
+        post = Post(author=g.user.load() or abort(401))
         form.populate_obj(post)
         
         db.session.add(post)
         db.session.commit()
 
+        signals.post_added.send(post)
+
         flash(_("Posting success"), "success")
 
         return redirect(post.url)
@@ -73,6 +74,8 @@ def edit(post_id):
         form.populate_obj(post)
 
         db.session.commit()
+
+        signals.post_updated.send(post)
         
         flash(_("Post has been changed"), "success")
         
@@ -92,11 +95,15 @@ def delete(post_id):
     
     db.session.delete(post)
     db.session.commit()
+
+    signals.post_deleted.send(post)
     
     if g.user.id != post.author_id:
         body = render_template("emails/post_deleted.html",
                                post=post)
 
+        from flaskext.mail import Message
+
         message = Message(subject="Your post has been deleted",
                           body=body,
                           recipients=[post.author.email])
@@ -117,7 +124,7 @@ def add_comment(post_id, parent_id=None):
 
     parent = Comment.query.get_or_404(parent_id) if parent_id else None
     
-    form = CommentForm()
+    form = comment_form()
 
     if form.validate_on_submit():
 
@@ -127,7 +134,7 @@ def add_comment(post_id, parent_id=None):
         form.populate_obj(comment)
 
         if g.user:
-            comment.author = g.user
+            comment.author = g.user.load() or abort(401)
 
         db.session.add(comment)
         db.session.commit()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    warm.py
+    ~~~~~~~~~~~~~
+
+    Cache warmup for `manage.py warm` and WARM_ON_BOOT. The front page
+    is requested first, which fills the sidebar (tag cloud, links,
+    archives, latest comments), then the feeds, the hot posts and the
+    tag pages are requested from a pool of threads, most visited first
+    according to the tail of WARM_ACCESS_LOG.
+
+    The pages are rendered through the app as an anonymous visitor in
+    each of ACCEPT_LANGUAGES, so the views stored by @cached() land
+    under the keys (path, locale and cache version) that visitors
+    asking for those languages look up, and the feeds fill their entry
+    fragments. With the `simple` cache only the warming process gains,
+    so with WARM_ON_BOOT the servers warm each worker as it starts
+    (fcgi.py), or the master before it forks (prefork.py).
+
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import re
+import time
+import Queue
+import threading
+
+from fnmatch import fnmatch
+
+from werkzeug.exceptions import HTTPException
+
+from pypress.extensions import db
+from pypress.models import Post, Tag
+
+# the views stored by @cached(), and the feeds
+ENDPOINTS = ('frontend.index', 'frontend.post', 'frontend.tag', 'frontend.tags',
+             'frontend.archive', 'feeds.*')
+
+# visited before anything else, in this order
+FIRST = ('/', '/feeds/', '/tags/', '/archive/', '/feeds/comments/')
+
+_request_re = re.compile(r'"GET (\S+) HTTP/[\d.]+" (\d{3}) ')
+
+
+def read_log(filename, size=4 * 1024 * 1024):
+    """
+    Returns {path: hits} of the successful GETs in the last size
+    bytes of an access log in common or combined format.
+    """
+    hits = {}
+    if not filename or not os.path.exists(filename):
+        return hits
+
+    with open(filename) as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        for line in f:
+            match = _request_re.search(line)
+            if match is None or match.group(2) != '200':
+                continue
+            path = match.group(1)
+            if '?' in path:
+                continue
+            hits[path] = hits.get(path, 0) + 1
+    return hits
+
+
+def cacheable(app, path):
+    """
+    True when path is served by one of the warmed endpoints.
+    """
+    try:
+        endpoint, args = app.url_map.bind('localhost').match(path, 'GET')
+    except HTTPException:
+        return False
+    return any(fnmatch(endpoint, p) for p in ENDPOINTS)
+
+
+def targets(app, hits=None, posts=50, tags=20):
+    """
+    The paths to warm, most important first: the pages of FIRST, then
+    the logged paths, latest posts and biggest tags by hits.
+    """
+    hits = dict((p, n) for p, n in (hits or {}).items() if cacheable(app, p))
+
+    candidates = set(hits)
+    with app.test_request_context():
+        candidates.update(post.url for post in
+                          Post.query.order_by(Post.created_date.desc()) \
+                                    .limit(posts))
+        candidates.update(tag.url for tag in
+                          sorted(Tag.query.cloud(),
+                                 key=lambda t: -t.num_posts)[:tags])
+        db.session.remove()
+
+    first = [p for p in FIRST if cacheable(app, p)]
+    candidates.difference_update(first)
+    rest = sorted(candidates, key=lambda p: (-hits.get(p, 0), p))
+    return first + rest
+
+
+def warm(app, paths, threads=4, locales=None):
+    """
+    Requests each path once per locale. The first path is requested
+    alone so the sidebar is computed once, not by every thread.
+    Returns (requests, errors, seconds).
+    """
+    if locales is None:
+        locales = app.config.get('ACCEPT_LANGUAGES', ['en'])
+
+    jobs = []
+    for path in paths:
+        # feeds are the same in every language
+        for locale in (locales[:1] if path.startswith('/feeds/') else locales):
+            jobs.append((path, locale))
+
+    lock = threading.Lock()
+    stats = dict(requests=0, errors=0)
+
+    def fetch(client, path, locale):
+        try:
+            response = client.get(path, headers=[('Accept-Language', locale)])
+            response.data
+            failed = response.status_code != 200
+        except Exception:
+            app.logger.exception("warming %s failed" % path)
+            failed = True
+        finally:
+            db.session.remove()
+        with lock:
+            stats['requests'] += 1
+            stats['errors'] += failed
+
+    start = time.time()
+    if jobs:
+        fetch(app.test_client(), *jobs[0])
+
+    queue = Queue.Queue()
+    for job in jobs[1:]:
+        queue.put(job)
+
+    def work():
+        client = app.test_client()
+        while True:
+            try:
+                job = queue.get_nowait()
+            except Queue.Empty:
+                return
+            fetch(client, *job)
+
+    workers = [threading.Thread(target=work) for i in range(max(1, threads))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return stats['requests'], stats['errors'], time.time() - start
+
+
+def run(app, posts=None, tags=None, threads=None, log=None):
+    """
+    Warms the cache with the settings of the app config.
+    """
+    config = app.config
+    if log is None and config.get('WARM_ACCESS_LOG'):
+        # relative to the app, like DEBUG_LOG and ERROR_LOG
+        log = os.path.join(app.root_path, config['WARM_ACCESS_LOG'])
+    hits = read_log(log)
+    paths = targets(app, hits,
+                    posts=posts or config.get('WARM_POSTS', 50),
+                    tags=tags or config.get('WARM_TAGS', 20))
+    rv = warm(app, paths, threads=threads or config.get('WARM_THREADS', 4))
+    app.logger.info("warmed %d pages (%d errors) in %.1fs" % rv)
+    return rv
+
+
+def on_boot(app):
+    """
+    With WARM_ON_BOOT, warms the cache in a background thread while
+    the server starts taking requests. Returns the thread or None.
+    """
+    if not app.config.get('WARM_ON_BOOT'):
+        return None
+
+    thread = threading.Thread(target=run, args=(app,))
+    thread.daemon = True
+    thread.start()
+    return thread